@@ -14,29 +14,15 @@ class compMinMeanMax(Analysis):
         super().__init__(cont, start, end, schema, maxDataPoints)
 
     def get_data(self, metrics, filters=[], params=None):
-        select = self.select_clause(metrics)
-        where_clause = self.get_where(filters)
- 
         try:
-            self.query.select(f'{select} {where_clause}')
-            res = self.query.next()
-            if res is None:
+            buckets = self.get_bucket_data(metrics, filters)
+            if buckets is None:
                 return None
-            df = res.copy(deep=True)
-            while res is not None:
-                res = self.query.next()
-                df = pd.concat([df, res])
-            ds = 15
-            df['time_downsample'] = df['timestamp'].astype('int')/1e9
-            df['time_downsample'] = df['time_downsample'].astype('int')%ds
-            df = df[df['time_downsample'] == 0]
-            df = df.drop(['time_downsample'],axis=1)
-            df['timestamp'] = df['timestamp'].astype(int) / 1e6
-            ret = pd.DataFrame(pd.unique(df['timestamp'].astype(int)), columns=['timestamp'])
+            ret = pd.DataFrame((buckets.times() * 1000).astype(np.int64), columns=['timestamp'])
             for metric in metrics:
-                ret[f'{metric}_min'] = df.groupby(by=['timestamp'])[metric].min().reset_index()[metric]
-                ret[f'{metric}_mean'] = df.groupby(by=['timestamp'])[metric].mean().reset_index()[metric]
-                ret[f'{metric}_max'] = df.groupby(by=['timestamp'])[metric].max().reset_index()[metric]
+                ret[f'{metric}_min'] = buckets.min(metric)
+                ret[f'{metric}_mean'] = buckets.mean(metric)
+                ret[f'{metric}_max'] = buckets.max(metric)
             return ret
         except Exception as e:
             a, b, c = sys.exc_info()
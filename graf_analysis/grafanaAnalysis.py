@@ -6,8 +6,12 @@ import numpy as np
 import pandas as pd
 from sosdb import Sos
 from sosdb.DataSet import DataSet
-from numsos.DataSource import SosDataSource
+from numsos.DataSource import SosDataSource, concat_results
 from numsos.Transform import Transform
+from numsos.Cache import LruCache, container_path
+from numsos.Group import Groups, TimeBuckets
+from numsos.Derived import DerivedMetrics
+from numsos.JobInfo import job_id_runs, job_id_where
 
 LOG_FILE = "/var/www/ovis_web_svcs/sosgui.log"
 LOG_DATE_FMT = "%F %T"
@@ -41,8 +45,18 @@ class MsgLog(object):
             self.fp.close()
         self.fp = None
 
+# Time buckets of query results shared by all analysis modules and
+# request threads
+range_cache = LruCache(max_bytes=256 * 1024 * 1024)
+
 # Base class for grafana analysis modules
 class Analysis(object):
+    # The width in seconds of the time buckets in the range cache
+    RANGE_BUCKET = 300
+    # Buckets that end less than this many seconds ago may still be
+    # receiving data and are not cached
+    RANGE_LAG = 60
+
     def __init__(self, cont, start, end, schema=None, maxDataPoints=4096):
         self.cont = cont
         self.schema = schema
@@ -52,25 +66,129 @@ class Analysis(object):
         self.mdp = maxDataPoints
 
     def get_all_data(self, query):
+        """Return all of the chunks of the query as one DataFrame
+
+        The chunks are collected in query order and concatenated
+        once. Each chunk is copied before the next one is read since
+        the query may reuse its buffers.
+        """
+        chunks = []
         df = query.next()
-        if df is None:
-           return None
-        res = df.copy(deep=True)
         while df is not None:
+            chunks.append(df.copy(deep=True))
             df = query.next()
-            res = pd.concat([df, res])
-        return res
+        if len(chunks) == 0:
+            return None
+        if len(chunks) == 1:
+            return chunks[0]
+        return pd.concat(chunks, ignore_index=True)
+
+    def get_bucket_data(self, metrics, filters=[]):
+        """Aggregate the metrics into time buckets as they are queried
+
+        The range is divided into at most maxDataPoints buckets and
+        each chunk returned by the query is added to the buckets and
+        discarded. See numsos.Group.TimeBuckets.
+
+        Returns:
+        A TimeBuckets or None if there is no data
+        """
+        if 'timestamp' not in metrics:
+            metrics = [ 'timestamp' ] + list(metrics)
+        buckets = TimeBuckets(self.start, self.end, count=self.mdp)
+        self.query.select(f'{self.select_clause(metrics)} {self.get_where(filters)}')
+        df = self.query.next()
+        if df is None:
+            return None
+        while df is not None:
+            buckets.add(df['timestamp'].to_numpy(),
+                        { m : df[m].to_numpy() for m in metrics if m != 'timestamp' })
+            df = self.query.next()
+        return buckets
+
+    def get_range_data(self, metrics, filters=[]):
+        """Return the data between start and end using the range cache
+
+        The range is divided into RANGE_BUCKET second time buckets.
+        The buckets that are complete are kept in the shared range
+        cache keyed by the container, schema, metrics and filters, so
+        when the dashboard refreshes with a shifted range only the
+        uncovered buckets and the partial buckets at the edges of the
+        range are queried.
+        """
+        if 'timestamp' not in metrics:
+            metrics = [ 'timestamp' ] + list(metrics)
+        key = (container_path(self.cont), self.schema, tuple(metrics), tuple(filters))
+        width = self.RANGE_BUCKET
+        first = int(np.ceil(self.start / width))
+        last = int(np.floor(min(self.end, time.time() - self.RANGE_LAG) / width))
+        if last <= first:
+            return self.query_range(metrics, filters, self.start, self.end)
+
+        buckets = {}
+        for b in range(first, last):
+            df = range_cache.get((key, b))
+            if df is not None:
+                buckets[b] = df
+        # Query each run of consecutive missing buckets at once
+        b = first
+        while b < last:
+            if b in buckets:
+                b += 1
+                continue
+            end = b
+            while end < last and end not in buckets:
+                end += 1
+            self.fill_buckets(key, metrics, filters, b, end, buckets)
+            b = end
+
+        pieces = [ self.query_range(metrics, filters, self.start, first * width) ]
+        pieces += [ buckets[b] for b in range(first, last) ]
+        pieces.append(self.query_range(metrics, filters, last * width, self.end, lo_op='>='))
+        pieces = [ df for df in pieces if df is not None and len(df) ]
+        if len(pieces) == 0:
+            return None
+        return pd.concat(pieces, ignore_index=True)
+
+    def fill_buckets(self, key, metrics, filters, first, last, buckets):
+        """Query the buckets [first, last) and add them to the range cache"""
+        width = self.RANGE_BUCKET
+        df = self.query_range(metrics, filters, first * width, last * width, lo_op='>=')
+        if df is None:
+            df = pd.DataFrame(columns=metrics)
+        codes = np.floor(df['timestamp'].astype('int64').to_numpy() / 1e9 / width)
+        if not np.all(codes[1:] >= codes[:-1]):
+            order = np.argsort(codes, kind='stable')
+            df = df.iloc[order]
+            codes = codes[order]
+        edges = np.searchsorted(codes, np.arange(first, last + 1))
+        for b in range(first, last):
+            # A copy, a slice would keep the whole query result alive
+            part = df.iloc[edges[b-first]:edges[b-first+1]].copy()
+            buckets[b] = part
+            range_cache.put((key, b), part, int(part.memory_usage(index=True).sum()))
+
+    def query_range(self, metrics, filters, lo, hi, lo_op='>'):
+        """Return the data with lo < timestamp < hi"""
+        if lo >= hi:
+            return None
+        self.query.select(f'{self.select_clause(metrics)} '
+                          f'{self.range_where(filters, lo, hi, lo_op)}')
+        return self.get_all_data(self.query)
 
     def select_clause(self, metrics):
         select = f'select {",".join(metrics)} from {self.schema}'
         return select
 
-    def get_where(self, filters):
-        where_clause = f'where (timestamp > {self.start}) and (timestamp < {self.end})'
+    def range_where(self, filters, lo, hi, lo_op='>'):
+        where_clause = f'where (timestamp {lo_op} {lo}) and (timestamp < {hi})'
         for filt in filters:
             where_clause += f' and ({filt})'
         return where_clause
 
+    def get_where(self, filters):
+        return self.range_where(filters, self.start, self.end)
+
     def parse_params(self, params):
         if params is None:
             self.threshold = 5
@@ -138,6 +256,24 @@ class papiAnalysis(Analysis):
             "PAPI_L3_TCA"  : "l3_tca",
             "PAPI_L3_TCM"  : "l3_tcm"
         }
+        # memory accesses are (ld_ins + sr_ins) and L1 misses are
+        # (l1_icm + l1_dcm), each computed once for all the metrics
+        self.papi_derived_spec = DerivedMetrics({
+            "cpi" : "tot_cyc / tot_ins",
+            "uopi" : "(ld_ins + sr_ins) / tot_ins",
+            "l1_miss_rate" : "(l1_icm + l1_dcm) / tot_ins",
+            "l1_miss_ratio" : "(l1_icm + l1_dcm) / (ld_ins + sr_ins)",
+            "l2_miss_rate" : "l2_tcm / tot_ins",
+            "l2_miss_ratio" : "l2_tcm / (ld_ins + sr_ins)",
+            "l3_miss_rate" : "l3_tcm / tot_ins",
+            "l3_miss_ratio" : "l3_tcm / (ld_ins + sr_ins)",
+            "l2_bw" : "l2_tca * 64e-6",
+            "l3_bw" : "l3_tca * 64e-6",
+            "fp_rate" : "fp_ops / tot_ins",
+            "branch_rate" : "br_ins / tot_ins",
+            "load_rate" : "ld_ins / tot_ins",
+            "store_rate" : "sr_ins / tot_ins"
+        })
         self.papi_derived_metrics = {
             "cpi" : "cpi",
             "uopi" : "uopi",
@@ -157,133 +293,120 @@ class papiAnalysis(Analysis):
 
     def derived_metrics(self, job_id):
         """Calculate derived papi metrics for a given job_id"""
+        res = self.derived_metrics_batch([ job_id ])
+        if res is None:
+            return None
+        xfrm, jobs = res
+        job_id = int(job_id)
+        if job_id not in jobs:
+            # Job was too short to record data
+            return (None, None)
+        return xfrm, jobs[job_id]
+
+    def derived_metrics_batch(self, job_ids, max_gap=None):
+        """Calculate derived papi metrics for a list of job_id
+
+        The job_id are split into runs of nearby job_id, see
+        numsos.JobInfo.job_id_runs(), and each run is read with a
+        range scan of the job_rank_time index. The rows of the jobs in
+        a run that were not asked for are discarded, and the derived
+        metrics of all of the jobs are computed at once. The result is
+        then split by job_id.
+
+        Positional Parameters:
+        -- A list of job_id
+
+        Keyword Parameters:
+        max_gap -- The largest job_id gap read within one range scan
+
+        Returns:
+        ( xfrm, jobs ) where jobs is a dictionary of job_id to the
+        DataSet of the job. A job that did not record any data is not
+        in the dictionary.
+        """
         try:
             self.derived_names = [ "tot_ins", "tot_cyc", "ld_ins", "sr_ins", "br_ins",
                                    "fp_ops", "l1_icm", "l1_dcm", "l2_ica", "l2_tca",
                                    "l2_tcm", "l3_tca", "l3_tcm" ]
-            src = SosDataSource()
-            src.config(cont=self.cont)
-            src.select(
-                [ 'PAPI_TOT_INS[timestamp]',
-                  'PAPI_TOT_INS[component_id]',
-                  'PAPI_TOT_INS[job_id]',
-                  'PAPI_TOT_INS[rank]' ] + list(self.event_name_map.keys()),
-                       from_    = list(self.event_name_map.keys()),
-                       where    = [ [ 'job_id', Sos.COND_EQ, int(job_id) ]
-                                ],
-                       order_by = 'job_rank_time')
-
-            xfrm = Transform(src, None)
-            res = xfrm.begin()
-            if res is None:
-                # Job was too short to record data
-                return (None, None)
-
-            while res is not None:
-                res = next(xfrm)
-                if res is not None:
-                    # concatenate TOP and TOP~1
-                    xfrm.concat()
-
-            # result now on top of stack
-            result = xfrm.pop()                  # result on top
+            job_ids = np.unique(np.asarray(job_ids, dtype=np.int64))
+            xfrm = Transform(None, None)
+            pieces = []
+            for run in job_id_runs(job_ids, max_gap):
+                src = SosDataSource()
+                src.config(cont=self.cont)
+                src.select(
+                    [ 'PAPI_TOT_INS[timestamp]',
+                      'PAPI_TOT_INS[component_id]',
+                      'PAPI_TOT_INS[job_id]',
+                      'PAPI_TOT_INS[rank]' ] + list(self.event_name_map.keys()),
+                           from_    = list(self.event_name_map.keys()),
+                           where    = job_id_where(run),
+                           order_by = 'job_rank_time')
+                xfrm = Transform(src, None)
+                if xfrm.collect() is not None:
+                    pieces.append(xfrm.pop())
+            if len(pieces) == 0:
+                # The jobs were too short to record data
+                return xfrm, {}
+
+            result = concat_results(pieces)
             # "Normalize" the event names
             for name in self.event_name_map:
                 result.rename(name, self.event_name_map[name])
 
             xfrm.push(result)
-            job = xfrm.pop()
-
-            # cpi = tot_cyc / tot_ins
-            job <<= job['tot_cyc'] / job['tot_ins'] >> 'cpi'
-
-            # memory accesses
-            mem_acc = job['ld_ins'] + job['sr_ins'] >> 'mem_acc'
-
-            # uopi = (ld_ins + sr_ins) / tot_ins
-            job <<= mem_acc / job['tot_ins'] >> 'uopi'
-
-            # l1_miss_rate = (l1_icm + l1_dcm) / tot_ins
-            l1_tcm = job['l1_icm'] + job['l1_dcm']
-            job <<=  l1_tcm / job['tot_ins'] >> 'l1_miss_rate'
-
-            # l1_miss_ratio = (l1_icm + l1_dcm) / (ld_ins + sr_ins)
-            job <<= l1_tcm / mem_acc >> 'l1_miss_ratio'
-
-            # l2_miss_rate = l2_tcm / tot_ins
-            job <<= job['l2_tcm'] / job['tot_ins'] >> 'l2_miss_rate'
-
-            # l2_miss_ratio = l2_tcm / mem_acc
-            job <<= job['l2_tcm'] / mem_acc >> 'l2_miss_ratio'
-
-            # l3_miss_rate = l3_tcm / tot_ins
-            job <<= job['l3_tcm'] / job['tot_ins'] >> 'l3_miss_rate'
-
-            # l3_miss_ratio = l3_tcm / mem_acc
-            job <<= job['l3_tcm'] / mem_acc >> 'l3_miss_ratio'
-
-            # l2_bandwidth = l2_tca * 64e-6
-            job <<= job['l2_tca'] * 64e-6 >> 'l2_bw'
-
-            # l3_bandwidth = (l3_tca) * 64e-6
-            job <<= job['l3_tca'] * 64e-6 >> 'l3_bw'
-
-            # floating_point
-            job <<= job['fp_ops'] / job['tot_ins'] >> 'fp_rate'
-
-            # branch
-            job <<= job['br_ins'] / job['tot_ins'] >> 'branch_rate'
-
-            # load
-            job <<= job['ld_ins'] / job['tot_ins'] >> 'load_rate'
-
-            # store
-            job <<= job['sr_ins'] / job['tot_ins'] >> 'store_rate'
-
-            return xfrm, job
+            xfrm.derive(self.papi_derived_spec)
+            data = xfrm.pop()
+
+            # Split the rows by job, discarding the jobs in the
+            # range that were not asked for
+            size = data.get_series_size()
+            groups = Groups(data.array('job_id'), size)
+            ordered = [ groups.take(data.array(name)) for name in data.series ]
+            jobs = {}
+            for start, count in zip(groups.starts, groups.counts):
+                job_id = int(ordered[data.series.index('job_id')][start])
+                if job_id not in job_ids:
+                    continue
+                count = int(count)
+                job = DataSet()
+                for name, nda in zip(data.series, ordered):
+                    job.append_array(count, name, nda[start:start+count])
+                job.set_series_size(count)
+                jobs[job_id] = job
+
+            return xfrm, jobs
 
         except Exception as e:
             a, b, c = sys.exc_info()
-            print('derived_metrics: Error: '+str(e)+' '+str(c.tb_lineno))
+            print('derived_metrics_batch: Error: '+str(e)+' '+str(c.tb_lineno))
             return None
 
     def papi_rank_stats(self, xfrm, job):
         try:
-            """Return min/max/standard deviation/mean for papi derived metrics"""
+            """Return min/max/standard deviation/mean for papi derived metrics
 
-            stats = DataSet()
-            xfrm.push(job)
+            The statistics of all events are computed in one pass and
+            returned in a single DataSet, which is returned as each
+            of the mins, maxs and stats results.
+            """
             events = job.series
             idx = events.index('rank')
             events = events[idx+1:]
-            # compute the rank containing the minima for each event
-            mins = DataSet()
-            for name in events:
-                xfrm.dup()
-                xfrm.min([ name ], group_name='rank')
-                xfrm.minrow(name+'_min')
-                xfrm.top().rename('rank', name + '_min_rank')
-                mins.append_series(xfrm.pop())
-
-            # compute the rank containing the maxima for each event
-            maxs = DataSet()
+
+            xfrm.push(job)
+            xfrm.aggregate(events)
+            stats = xfrm.pop()
+
+            # the rank containing the minima and maxima for each event
+            ranks = job.array('rank')
             for name in events:
-                xfrm.dup()
-                xfrm.max([ name ], group_name='rank')
-                xfrm.maxrow(name+'_max')
-                xfrm.top().rename('rank', name + '_max_rank')
-                maxs.append_series(xfrm.pop())
-
-            # compute the standard deviation
-            xfrm.dup()
-            xfrm.std(events)
-            stats.append_series(xfrm.pop())
-
-            # mean
-            xfrm.mean(events)
-            stats.append_series(xfrm.pop())
-
-            return (events, mins, maxs, stats)
+                stats.append_array(1, name + '_min_rank',
+                                   ranks[stats.array(name + '_argmin')[0:1]])
+                stats.append_array(1, name + '_max_rank',
+                                   ranks[stats.array(name + '_argmax')[0:1]])
+
+            return (events, stats, stats, stats)
         except Exception as e:
             a, b, c = sys.exc_info()
             print('papi_rank_stats: Error: '+str(e)+' '+str(c.tb_lineno))
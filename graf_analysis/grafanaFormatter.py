@@ -4,26 +4,86 @@ import numpy as np
 import pandas as pd
 import copy
 
+def json_column(nda):
+    """Return a numpy array as a list of JSON serializable values
+
+    The whole column is converted at once. A datetime64 is converted
+    to milliseconds since the epoch, a string to str decoded as UTF-8
+    with invalid bytes replaced, an array valued
+    row to its str() and a NaN or NaT to None.
+    """
+    nda = np.asarray(nda)
+    if nda.ndim > 1:
+        return [ str(v) for v in nda ]
+    kind = nda.dtype.kind
+    if kind == 'M':
+        nat = np.isnat(nda)
+        nda = nda.astype('datetime64[ns]').astype(np.int64) / 1.0e6
+        if nat.any():
+            nda = nda.astype(object)
+            nda[nat] = None
+        return nda.tolist()
+    if kind == 'S':
+        # Bytes that are not UTF-8 are replaced rather than failing
+        # the request
+        return np.char.decode(nda, 'utf-8', 'replace').tolist()
+    if kind == 'U':
+        return nda.tolist()
+    if kind == 'f':
+        nan = np.isnan(nda)
+        if nan.any():
+            nda = nda.astype(object)
+            nda[nan] = None
+        return nda.tolist()
+    if kind == 'O':
+        return [ v.decode('utf-8', 'replace') if type(v) == bytes else v
+                 for v in nda.tolist() ]
+    return nda.tolist()
+
+def json_rows(columns):
+    """Return a list of rows from a list of json_column() lists"""
+    return [ list(row) for row in zip(*columns) ]
+
 class RowIter(object):
+    """Iterate over the rows of a DataSet as lists of JSON values
+
+    Each series is converted once with json_column() when the
+    iterator is created and the rows are formed from the converted
+    columns.
+    """
     def __init__(self, dataSet):
         self.dset = dataSet
         self.limit = dataSet.get_series_size()
-        self.row_no = 0
+        self.columns = [ json_column(dataSet.array(name)[0:self.limit])
+                         for name in dataSet.series ]
+        self.rows = zip(*self.columns)
 
     def __iter__(self):
         return self
 
-    def cvt(self, value):
-        if type(value) == np.datetime64:
-            return [ value.astype(np.int64) / 1000 ]
-        return value
-
     def __next__(self):
-        if self.row_no >= self.limit:
-            raise StopIteration
-        res = [ self.cvt(self.dset[[col, self.row_no]]) for col in range(0, self.dset.series_count) ]
-        self.row_no += 1
-        return res
+        return list(next(self.rows))
+
+def json_type(nda):
+    """Return the Grafana data frame field type of a numpy array"""
+    kind = np.asarray(nda).dtype.kind
+    if kind == 'M':
+        return "time"
+    if kind == 'b':
+        return "boolean"
+    if kind in 'iuf':
+        return "number"
+    return "string"
+
+def json_frame(names, arrays):
+    """Return the columns as a Grafana data frame
+
+    The values of each field are a json_column() list, no rows are
+    formed.
+    """
+    return { "schema" : { "fields" : [ { "name" : name, "type" : json_type(nda) }
+                                       for name, nda in zip(names, arrays) ] },
+             "data" : { "values" : [ json_column(nda) for nda in arrays ] } }
 
 class DataFormatter(object):
     def __init__(self, data):
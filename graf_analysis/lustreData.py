@@ -3,12 +3,17 @@ import datetime as dt
 from graf_analysis.grafanaAnalysis import Analysis
 from numsos.DataSource import SosDataSource
 from numsos.Transform import Transform
+from numsos.JobInfo import JobInfoResolver
+from numsos.Cache import LruCache
 from sosdb.DataSet import DataSet
 from sosdb import Sos
 import time
 import pandas as pd
 import numpy as np
 
+# The records of completed jobs, shared by the requests
+job_cache = LruCache(max_items=65536)
+
 class lustreData(Analysis):
     def __init__(self, cont, start, end, schema='Lustre_Client', maxDataPoints=4096):
         self.start = start
@@ -16,8 +21,10 @@ class lustreData(Analysis):
         self.schema = schema
         self.src = SosDataSource()
         self.src.config(cont=cont)
-        self.job_metrics = [ 'mt-slurm[job_name]', 'mt-slurm[job_user]', 'mt-slurm[job_id]',
-                             'mt-slurm[job_start]', 'mt-slurm[job_end]', 'mt-slurm[job_size]' ]
+        self.jobs = JobInfoResolver(cont, schema='mt-slurm',
+                                    columns=[ 'job_id', 'job_name', 'job_user', 'uid',
+                                              'job_start', 'job_end', 'job_size' ],
+                                    cache=job_cache)
         self.where_ = []
         self.where_ = [ [ 'job_id', Sos.COND_GT, 1 ] ]
         if self.start > 0:
@@ -33,30 +40,36 @@ class lustreData(Analysis):
 
     def _sum_metrics(self, metrics):
         try:
-            ''' Return tuple of (metric_per_second nd array, dataset) '''
+            ''' Return the sum of the metric differences for each job '''
             self.src.select([ 'job_id', 'component_id' ] + metrics,
                        from_ = [ self.schema ],
                        where = self.where_,
                        order_by = 'time_job_comp'
                 )
-            self.xfrm = Xfrm(self.src, None)
-            # set metrics in Xfrm class
-            self.xfrm.set_metrics(metrics)
+            self.xfrm = Transform(self.src, None)
 
-            resp = self.xfrm.begin()
+            resp = self.xfrm.collect()
             if resp is None:
                 return None
-            while resp is not None:
-                resp = next(self.xfrm)
-                if resp is not None:
-                    self.xfrm.concat()
 
-            self.xfrm.for_each(series_list=['job_id'], xfrm_fn=self.xfrm.job_diff)
-            return self.xfrm.sum_
+            # difference each component of each job, then total the
+            # differences by job
+            self.xfrm.diff(metrics, group_name=[ 'job_id', 'component_id' ],
+                           xfrm_suffix='')
+            diffs = self.xfrm.top()
+            for m in metrics:
+                np.nan_to_num(diffs.array(m), copy=False)
+            self.xfrm.sum(metrics, group_name='job_id', xfrm_suffix='')
+            sums = self.xfrm.pop()
+            self.job_ids = sums.array('job_id')[0:sums.get_series_size()]
+            rate = np.zeros([ sums.get_series_size() ])
+            for m in metrics:
+                rate += sums.array(m)[0:sums.get_series_size()]
+            return rate
         except Exception as e:
             a, b, c = sys.exc_info()
             print(str(e) + ' '+str(c.tb_lineno))
-            return None, None
+            return None
 
     def get_lustre_avg(self, metrics):
         try:
@@ -71,46 +84,48 @@ class lustreData(Analysis):
             ret_user = []
             ret_state = []
             ret_size = []
+            # Rank the jobs by bytes, most first. Jobs that are not
+            # found are skipped, so more than threshold jobs may be
+            # needed; the next candidates are selected when the
+            # current ones are used up.
+            ranked = DataSet()
+            ranked.append_array(len(sumbytes), 'job_id', self.job_ids)
+            ranked.append_array(len(sumbytes), 'bytes', sumbytes)
+            ranked.set_series_size(len(sumbytes))
+            k = self.threshold
+            top = None
+            row = 0
             i = 0
-            jids = self.xfrm.job_ids
-            res = []
-            while i < self.threshold:
-                if len(sumbytes) < 1:
-                    break
-                index, val = max(enumerate(sumbytes), key=operator.itemgetter(1))
-                where_ = [ [ 'job_id' , Sos.COND_EQ, jids[index] ] ]
-                if self.user_id != 0:
-                    where_.append(['uid', Sos.COND_EQ, self.user_id])
-                self.src.select(self.job_metrics,
-                                from_ = [ 'mt-slurm' ],
-                                where = where_,
-                                order_by = 'job_rank_time'
-                    )
-                job = self.src.get_results()
-                res.append(job)
+            while i < self.threshold and row < len(sumbytes):
+                if top is None or row >= top.get_series_size():
+                    self.xfrm.push(ranked)
+                    self.xfrm.topk('bytes', k)
+                    top = self.xfrm.pop()
+                    k *= 2
+                    # look up the new candidates at once
+                    jobs = self.jobs.lookup(top.array('job_id')[row:top.get_series_size()])
+                val = top.array('bytes')[row]
+                job = jobs.get(int(top.array('job_id')[row]))
+                row += 1
                 if job is None:
-                    sumbytes = np.delete(sumbytes, index)
-                    jids = np.delete(jids, index)
                     continue
-                job_start = np.min(job.array('job_start'))
-                if job.array('job_end')[0] < 1:
+                if self.user_id != 0 and job['uid'] != self.user_id:
+                    continue
+                job_start = job['job_start']
+                if job['job_end'] < 1:
                     job_end = time.time()
                     ret_end.append(job_end*1000)
                     ret_state.append("In process")
                 else:
-                    job_end = np.max(job.array('job_end'))
+                    job_end = job['job_end']
                     ret_end.append(job_end*1000)
                     ret_state.append("Completed")
                 ret_bps.append(val / (job_end - job_start))
-                ret_jobs.append(job.array('job_id')[0])
-                ret_size.append(job.array('job_size')[0])
-                ret_name.append(job.array('job_name')[0].decode())
+                ret_jobs.append(job['job_id'])
+                ret_size.append(job['job_size'])
+                ret_name.append(job['job_name'].decode())
                 ret_start.append(job_start * 1000)
-                ret_user.append(job.array('job_user')[0].decode())
-
-                # remove job with highest bps from list of jobs
-                sumbytes = np.delete(sumbytes, index)
-                jids = np.delete(jids, index)
+                ret_user.append(job['job_user'].decode())
                 i += 1
             res_ = DataSet()
             if not self._meta:
@@ -129,27 +144,3 @@ class lustreData(Analysis):
             a, b, c = sys.exc_info()
             print(str(e)+' '+str(c.tb_lineno))
             return None
-
-class Xfrm(Transform):
-    def set_metrics(self, metrics):
-        self.metrics = metrics
-        self.job_ids = []
-        self.sum_ = []
-
-    def job_diff(self, values):
-        self.dup()
-        try:
-            self.diff(self.metrics, group_name='component_id',
-                      xfrm_suffix='')
-            #self.mean(self.metrics, xfrm_suffix='')
-            self.sum(self.metrics, xfrm_suffix='')
-            sum_ = self.pop()
-            rate = 0
-            for m in self.metrics:
-                rate += sum_.array(m)[0]
-            self.job_ids.append(values[0])
-            self.sum_.append(rate)
-
-        except Exception as e:
-            a, b, c = sys.exc_info()
-            print(str(e)+' '+str(c.tb_lineno))
@@ -1,5 +1,6 @@
 import sys
 from graf_analysis.grafanaAnalysis import Analysis
+from numsos.Group import group_diff
 from sosdb import Sos
 import pandas as pd
 
@@ -8,18 +9,15 @@ class metricRate(Analysis):
         super().__init__(cont, start, end, schema, maxDataPoints)
 
     def get_data(self, metrics, filters=[], params=None):
-        select = self.select_clause(metrics)
-        where_clause = self.get_where(filters)
-        self.query.select(f'{select} {where_clause}')
-        res = self.query.next()
+        res = self.get_range_data(metrics, filters)
         if res is None:
             return None
         try:
             res = res[~res.index.duplicated(keep='first')]
             ret = pd.DataFrame(res['timestamp'].astype('int') / 1e6 , columns=['timestamp'])
-            res = res.drop('timestamp', axis=1)
-            res = res.groupby(['component_id'], as_index=False).diff().fillna(0)
-            ret.insert(1, f'Active Rate', res['Active'], True)
+            active = group_diff(res['component_id'].to_numpy(),
+                                res['Active'].to_numpy())
+            ret.insert(1, f'Active Rate', active, True)
             return ret
         except Exception as e:
             a, b, c = sys.exc_info()
@@ -1,6 +1,7 @@
 import os, sys, traceback
 import datetime as dt
 from graf_analysis.grafanaAnalysis import Analysis
+from numsos.Group import group_diff, bin_sum
 from sosdb import Sos
 import pandas as pd
 import numpy as np
@@ -10,21 +11,16 @@ class metricRateBin(Analysis):
         super().__init__(cont, start, end, schema, maxDataPoints)
 
     def get_data(self, metrics, filters=[], params='bins=10'):
-        select = self.select_clause(metrics)
-        where_clause = self.get_where(filters)
         self.bins = 10
         result = []
         datapoints = []
         time_range = self.end - self.start
         try:
-            self.query.select(f'{select} {where_clause}')
-
-            # default for now is dataframe - will update with dataset vs dataframe option
-            df = self.query.next()
+            df = self.get_range_data(metrics, filters)
             if df is None:
                 return None
             df = df[~df.index.duplicated(keep='first')]
-            tstamps = df['timestamp'].astype('int') / 1e6
+            tstamps = df['timestamp'].astype('int').to_numpy() / 1e6
             df = df.drop('timestamp', axis=1)
             data_time = tstamps[-1] - tstamps[0]
             if data_time < time_range:
@@ -33,20 +29,15 @@ class metricRateBin(Analysis):
                     bins = 2
             else:
                 bins = 20
-            dff = df.groupby(['component_id']).diff().fillna(0)
-            hsum = None
-            metric_str = ''
-            for metric in metrics:
-                if len(metric_str) > 0:
-                    metric_str += ', '
-                metric_str += metric
-                os = dff[metric]
-                h = np.histogram(tstamps, bins=bins,
-                                 weights=os, density=False)
-                if hsum is None:
-                    ts = h[1][:-1]
-                    hsum = np.zeros(h[0].shape)
-                hsum += h[0]
+            # difference each component, then add up the metrics and
+            # sum them into the bins at once
+            names = [ m for m in metrics if m not in ('timestamp', 'component_id') ]
+            deltas = group_diff(df['component_id'].to_numpy(),
+                                df[names].to_numpy())
+            h = bin_sum(tstamps, deltas.sum(axis=1), bins)
+            hsum = h[0]
+            ts = h[1][:-1]
+            metric_str = ', '.join(names)
             ret = pd.DataFrame(ts, columns=['timestamp'])
             ret.insert(0, f'{metric_str} Rate', hsum, True)
             
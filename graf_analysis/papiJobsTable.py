@@ -24,13 +24,9 @@ class papiJobsTable(papiAnalysis):
                        order_by = 'job_rank_time'
             )
             self.xfrm = Transform(self.src, None, limit=1000000)
-            res = self.xfrm.begin()
+            res = self.xfrm.collect()
             if not res:
                 return None
-            while res is not None:
-                res = next(self.xfrm)
-                if res is not None:
-                    self.xfrm.concat()
             result = self.xfrm.pop()
             cols = [ { "text" : "job_id" },
                      { "text" : "CPU Dashboards" },
@@ -4,6 +4,7 @@ from sosdb import Sos
 from sosdb.DataSet import DataSet
 from numsos.DataSource import SosDataSource
 from numsos.Transform import Transform
+from numsos.Summary import JobSummary, SUMMARY_SUFFIX
 from graf_analysis.grafanaAnalysis import Analysis
 import numpy as np
 import pandas as pd
@@ -44,16 +45,10 @@ class rankMemByJob(Analysis):
         ''' Memory utilization ratio calculation '''
         try:
             self.xfrm = Transform(self.src, None, limit=self.mdp)
-            resp = self.xfrm.begin()
-            if resp is None:
+            data = self.xfrm.collect()
+            if data is None:
                 return None
 
-            while resp is not None:
-                resp = next(self.xfrm)
-                if resp is not None:
-                    self.xfrm.concat()
-
-            data = self.xfrm.top()
             memUsedRatio = (data['MemTotal'] - data['MemAvailable']) / data['MemTotal'] >> 'Mem_Used_Ratio'
             self.stdd = memUsedRatio.std()
             self.mean = memUsedRatio.mean()
@@ -128,8 +123,49 @@ class rankMemByJob(Analysis):
         res.append_array(7, "Count", counts)
         return res
 
+    def _mem_summary(self):
+        ''' Return the job summary of the schema if there is one, see bin/job_summary '''
+        summary = JobSummary(self.cont, str(self.schema) + SUMMARY_SUFFIX)
+        if not summary.exists():
+            return None
+        return summary
+
+    def _summary_mem(self, summary, threshold, largest):
+        ''' Get the jobs with the highest or lowest memory use from the job summary '''
+        comps = summary.get_results([ 'Mem_Used_Ratio' ],
+                                    start=self.start, end=self.end)
+        if comps is None:
+            return None
+        if largest:
+            comps = comps > ('job_id', 1)
+            ratio, agg = 'Mem_Used_Ratio_max', 'max'
+        else:
+            ratio, agg = 'Mem_Used_Ratio_min', 'min'
+        xfrm = Transform(None, None)
+        xfrm.push(comps)
+        xfrm.aggregate([ ratio, 'first', 'last' ],
+                       aggs=[ 'min', 'max', 'arg' + agg ], group_name='job_id')
+        jobs = xfrm.pop()
+        count = jobs.get_series_size()
+        rows = jobs.array(ratio + '_arg' + agg)[0:count]
+        memUsedRatio = DataSet()
+        memUsedRatio.append_array(count, 'job_id', jobs.array('job_id')[0:count])
+        memUsedRatio.append_array(count, 'component_id', comps.array('component_id')[rows])
+        memUsedRatio.append_array(count, 'Mem_Used_Ratio', jobs.array(ratio + '_' + agg)[0:count])
+        for name, series in (( 'job_start', 'first_min' ), ( 'job_end', 'last_max' )):
+            usecs = (jobs.array(series)[0:count] * 1.0e6).astype(np.int64)
+            memUsedRatio.append_array(count, name, usecs.astype('datetime64[us]'))
+        memUsedRatio.set_series_size(count)
+        xfrm.push(memUsedRatio)
+        xfrm.topk('Mem_Used_Ratio', threshold - 1 if largest else threshold,
+                  largest=largest)
+        return xfrm.pop()
+
     def _get_high_mem(self, threshold):
         ''' Get high memory threshold nodes with running jobs '''
+        summary = self._mem_summary()
+        if summary is not None:
+            return self._summary_mem(summary, threshold, largest=True)
         where_ = [ [ 'job_id', Sos.COND_GT, 1 ],
                    [ 'timestamp', Sos.COND_GE, self.start ] ]
         if self.end > 0:
@@ -150,13 +186,15 @@ class rankMemByJob(Analysis):
         memUsedRatio = self.xfrm.pop()
         memUsedRatio <<= job_times['job_start']
         memUsedRatio <<= job_times['job_end']
-        top_jobs = np.sort(memUsedRatio.array('Mem_Used_Ratio'))
-        if memUsedRatio.get_series_size() > threshold:
-             memUsedRatio = memUsedRatio > ('Mem_Used_Ratio', top_jobs[len(top_jobs) - threshold])
-        return memUsedRatio
+        self.xfrm.push(memUsedRatio)
+        self.xfrm.topk('Mem_Used_Ratio', threshold - 1)
+        return self.xfrm.pop()
 
     def _get_low_mem(self, threshold):
         ''' Get low memory threshold nodes with running jobs '''
+        summary = self._mem_summary()
+        if summary is not None:
+            return self._summary_mem(summary, threshold, largest=False)
         where_ = [ [ 'job_id', Sos.COND_GE, 1 ],
                    [ 'timestamp', Sos.COND_GE, self.start ] ]
         if self.end > 0:
@@ -177,10 +215,9 @@ class rankMemByJob(Analysis):
         memUsedRatio = self.xfrm.pop()
         memUsedRatio <<= job_times['job_start']
         memUsedRatio <<= job_times['job_end']
-        bot_jobs = np.sort(memUsedRatio.array('Mem_Used_Ratio'))
-        if memUsedRatio.get_series_size() > threshold:
-            memUsedRatio = memUsedRatio < ('Mem_Used_Ratio', bot_jobs[threshold])
-        return memUsedRatio
+        self.xfrm.push(memUsedRatio)
+        self.xfrm.topk('Mem_Used_Ratio', threshold, largest=False)
+        return self.xfrm.pop()
 
     def _get_idle_high_mem(self, threshold):
         ''' Get high mem threshold for idle nodes '''
@@ -198,11 +235,8 @@ class rankMemByJob(Analysis):
             return None
         self.xfrm.max([ 'Mem_Used_Ratio' ], group_name='component_id',
                       keep=['timestamp', 'job_id', 'component_id'])
-        memUsedRatio = self.xfrm.pop()
-        top_jobs = np.sort(memUsedRatio.array('Mem_Used_Ratio_max'))
-        if memUsedRatio.get_series_size() > threshold:
-            memUsedRatio = memUsedRatio > ('Mem_Used_Ratio_max', top_jobs[len(top_jobs) - threshold])
-        return memUsedRatio
+        self.xfrm.topk('Mem_Used_Ratio_max', threshold - 1)
+        return self.xfrm.pop()
 
     def _get_idle_low_mem(self, threshold):
         ''' Get low mem threshold for idle nodes '''
@@ -218,11 +252,8 @@ class rankMemByJob(Analysis):
         memUsedRatio = self._mem_used_ratio()
         if memUsedRatio is None:
             return None
-        _min = self.xfrm.min([ 'Mem_Used_Ratio' ], group_name='component_id',
-                             keep=['timestamp', 'job_id', 'component_id'])
-        memUsedRatio = self.xfrm.pop()
-        bot_jobs = np.sort(memUsedRatio.array('Mem_Used_Ratio_min'))
-        if memUsedRatio.get_series_size() > threshold:
-            memUsedRatio = memUsedRatio < ('Mem_Used_Ratio_min', bot_jobs[threshold])
-        return memUsedRatio 
+        self.xfrm.min([ 'Mem_Used_Ratio' ], group_name='component_id',
+                      keep=['timestamp', 'job_id', 'component_id'])
+        self.xfrm.topk('Mem_Used_Ratio_min', threshold, largest=False)
+        return self.xfrm.pop()
 
@@ -1,4 +1,4 @@
-from graf_analysis.grafanaFormatter import DataFormatter, RowIter
+from graf_analysis.grafanaFormatter import DataFormatter, json_column, json_rows, json_frame
 from sosdb.DataSet import DataSet
 from sosdb import Sos
 import numpy as np
@@ -6,23 +6,37 @@ import pandas as pd
 import copy
 
 class table_formatter(DataFormatter):
+    """Format a result as a Grafana table
+
+    Keyword Parameters:
+    frame -- If True, return a Grafana data frame, i.e. the values of
+             each column, instead of a list of rows
+    """
+    def __init__(self, data, frame=False):
+        super().__init__(data)
+        self.frame = frame
+
     def fmt_dataset(self):
         # Format data from sosdb DataSet object
         if self.data is None:
             return {"columns" : [{ "text" : "No papi jobs in time range" }] }
 
+        size = self.data.get_series_size()
+        arrays = [ self.data.array(name)[0:size] for name in self.data.series ]
+        if self.frame:
+            return json_frame(self.data.series, arrays)
         self.result = { "type" : "table" }
         self.result["columns"] = [ { "text" : colName } for colName in self.data.series ]
-        rows = []
-        for row in RowIter(self.data):
-            rows.append(row)
-        self.result["rows"] = rows
+        self.result["rows"] = json_rows([ json_column(nda) for nda in arrays ])
         return self.result
 
     def fmt_dataframe(self):
         if self.data is None:
             return {"columns" : [{ "text" : "No papi jobs in time range" }] }
 
+        if self.frame:
+            return json_frame(list(self.data.columns),
+                              [ self.data[name].values for name in self.data.columns ])
         self.result = { "type" : "table" }
         self.result["columns"] = [ { "text" : colName } for colName in self.data.columns ]
         self.result["rows"] = self.data.to_numpy()
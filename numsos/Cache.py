@@ -0,0 +1,329 @@
+from builtins import object
+from collections import OrderedDict
+import numpy as np
+from sosdb.DataSet import DataSet
+from sosdb import Sos
+import datetime as dt
+import hashlib
+import json
+import shutil
+import threading
+import time
+import os
+
+class ResultCache(object):
+    """An on-disk cache of query results
+
+    Each result is stored in a directory named by a hash of the query
+    specification. The directory contains a manifest and one numpy
+    .npy file for each series. A cached result is returned as a
+    DataSet whose series are read-only memory maps of the .npy files,
+    so the data is not read until it is used and is not copied.
+
+    The manifest records the query specification and the generation
+    of the container the result was read from, see query_generation().
+    A cached result is ignored if the generation has changed since it
+    was stored.
+
+    When a result is stored and the cache holds more than max_entries
+    results or max_bytes bytes, the least recently used results are
+    removed until it fits. The time of last use of a result is the
+    modification time of its manifest, which get() updates, so the
+    budget also holds when several processes share the directory.
+
+    Positional Parameters:
+    -- The path to the cache directory. It is created if it does not
+       exist.
+
+    Keyword Parameters:
+    max_bytes   -- The maximum total size of the cached results, the
+                   default is DEF_MAX_BYTES
+    max_entries -- The maximum number of cached results, the default
+                   is no limit
+
+    Example:
+
+        src = SosDataSource()
+        src.config(path='/DATA15/orion/ldms_data', cache='/tmp/numsos_cache')
+    """
+    DEF_MAX_BYTES = 1024 * 1024 * 1024
+
+    def __init__(self, path, max_bytes=None, max_entries=None):
+        self.path = path
+        if max_bytes is None:
+            max_bytes = self.DEF_MAX_BYTES
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def key(self, spec):
+        """Return the cache key for a query specification
+
+        The specification is a sequence of values whose repr() is
+        the same for the same query, for example the column names,
+        the where conditions and the limit.
+        """
+        return hashlib.sha1(repr(spec).encode('utf-8')).hexdigest()
+
+    def get(self, key, generation=None):
+        """Return the cached DataSet or None if it is not cached
+
+        Positional Parameters:
+        -- The cache key, see key()
+
+        Keyword Parameters:
+        generation -- The current generation of the container
+        """
+        entry = os.path.join(self.path, key)
+        path = os.path.join(entry, 'manifest.json')
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if manifest['generation'] != generation:
+            return None
+        try:
+            # Mark the result most recently used
+            os.utime(path)
+        except OSError:
+            return None
+        rows = manifest['rows']
+        result = DataSet()
+        try:
+            for col_no, name in enumerate(manifest['series']):
+                nda = np.load(os.path.join(entry, '{0}.npy'.format(col_no)),
+                              mmap_mode='r')
+                result.append_array(rows, name, nda)
+        except (IOError, OSError, ValueError):
+            # The result was removed or replaced by another process
+            return None
+        result.set_series_size(rows)
+        return result
+
+    def put(self, key, spec, result, generation=None):
+        """Store a DataSet in the cache
+
+        A DataSet with object series, which cannot be memory mapped,
+        is not stored.
+
+        Positional Parameters:
+        -- The cache key, see key()
+        -- The query specification, which is saved in the manifest
+        -- The DataSet
+
+        Keyword Parameters:
+        generation -- The current generation of the container
+
+        Returns:
+        True if the result was stored. The cache is best-effort, a
+        result that cannot be written, e.g. because another process
+        is storing the same key, is not stored.
+        """
+        rows = result.get_series_size()
+        names = result.series
+        arrays = [ result.array(name)[0:rows] for name in names ]
+        for nda in arrays:
+            if nda.dtype.hasobject:
+                return False
+        entry = os.path.join(self.path, key)
+        tmp = '{0}.{1}.tmp'.format(entry, os.getpid())
+        try:
+            if os.path.isdir(tmp):
+                shutil.rmtree(tmp)
+            os.makedirs(tmp)
+            for col_no, nda in enumerate(arrays):
+                np.save(os.path.join(tmp, '{0}.npy'.format(col_no)), nda)
+            with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+                json.dump({ "spec" : repr(spec), "generation" : generation,
+                            "series" : names, "rows" : rows }, f)
+            if os.path.isdir(entry):
+                shutil.rmtree(entry)
+            os.rename(tmp, entry)
+        except (IOError, OSError):
+            shutil.rmtree(tmp, ignore_errors=True)
+            return False
+        self.evict(keep=key)
+        return True
+
+    def evict(self, keep=None):
+        """Remove the least recently used results that exceed the budget
+
+        Keyword Parameters:
+        keep -- The key of a result that is not removed, e.g. the one
+                just stored
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            if name.endswith('.tmp'):
+                continue
+            entry = os.path.join(self.path, name)
+            try:
+                used = os.stat(os.path.join(entry, 'manifest.json')).st_mtime_ns
+                size = sum(os.stat(os.path.join(entry, f)).st_size
+                           for f in os.listdir(entry))
+            except OSError:
+                continue
+            entries.append((used, name, size))
+            total += size
+        entries.sort()
+        count = len(entries)
+        for used, name, size in entries:
+            if (self.max_entries is None or count <= self.max_entries) and \
+               (self.max_bytes is None or total <= self.max_bytes):
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+            count -= 1
+            total -= size
+
+    def clear(self):
+        """Remove all of the cached results"""
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+
+# Data older than this many seconds is assumed not to change, see
+# query_generation()
+DEF_CLOSED_LAG = 600
+
+def query_generation(path, where, time_attr='timestamp', lag=None):
+    """Return a value that changes when the result of a query may change
+
+    If the where conditions bound time_attr above by a time more than
+    lag seconds ago, the query is for data that is complete and its
+    result does not change as samples are added. Its generation is
+    the list of files in the container directory, which only changes
+    when a partition is added or removed, e.g. by retention, and the
+    container is not walked. Otherwise the generation is
+    container_generation().
+
+    Positional Parameters:
+    -- The path to the container
+    -- The where conditions of the query, see SosDataSource.select()
+
+    Keyword Parameters:
+    time_attr -- The name of the time attribute
+    lag       -- The age in seconds of data that does not change, the
+                 default is DEF_CLOSED_LAG
+    """
+    if lag is None:
+        lag = DEF_CLOSED_LAG
+    bound = where_upper_bound(where, time_attr)
+    if bound is not None and bound < time.time() - lag:
+        return [ 'closed' ] + sorted(os.listdir(path))
+    return container_generation(path)
+
+def where_upper_bound(where, time_attr='timestamp'):
+    """Return the upper bound in seconds of time_attr in where or None"""
+    bound = None
+    for cond in where or []:
+        if cond[0] != time_attr or \
+           cond[1] not in (Sos.COND_LT, Sos.COND_LE, Sos.COND_EQ):
+            continue
+        secs = _seconds(cond[2])
+        if secs is not None and (bound is None or secs < bound):
+            bound = secs
+    return bound
+
+def _seconds(value):
+    if isinstance(value, (tuple, list)):
+        return float(value[0]) + float(value[1]) / 1.0e6
+    if isinstance(value, dt.datetime):
+        return value.timestamp()
+    if isinstance(value, np.datetime64):
+        return value.astype('datetime64[us]').astype(np.int64) / 1.0e6
+    if isinstance(value, (int, float, np.number)):
+        return float(value)
+    return None
+
+def container_generation(path):
+    """Return a value that changes when the container is modified
+
+    The value is the latest modification time of the files in the
+    container directory.
+    """
+    generation = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames + [ '.' ]:
+            try:
+                mtime = os.stat(os.path.join(dirpath, name)).st_mtime_ns
+            except OSError:
+                continue
+            if mtime > generation:
+                generation = mtime
+    return generation
+
+def container_path(cont):
+    """Return the real path of a container for use in a cache key
+
+    Unlike id(cont), the path is the same when the container is
+    reopened and is not reused by another container.
+
+    Positional Parameters:
+    -- A Sos.Container or the path to the container
+    """
+    path = cont
+    if not isinstance(cont, (str, bytes)):
+        path = cont.path
+        if callable(path):
+            path = path()
+    if isinstance(path, bytes):
+        path = path.decode('utf-8')
+    return os.path.realpath(path)
+
+class LruCache(object):
+    """A least recently used cache with an item and byte budget
+
+    When an item is added and the cache holds more than max_items
+    items or max_bytes bytes, the least recently used items are
+    evicted until it fits. The cache may be shared by threads.
+
+    Keyword Parameters:
+    max_items -- The maximum number of items, the default is no limit
+    max_bytes -- The maximum total size of the items, the default is
+                 no limit
+    """
+    def __init__(self, max_items=None, max_bytes=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key, default=None):
+        """Return the item for key and mark it most recently used"""
+        with self.lock:
+            if key not in self.items:
+                return default
+            self.items.move_to_end(key)
+            return self.items[key][0]
+
+    def put(self, key, value, size=0):
+        """Add an item of size bytes to the cache"""
+        with self.lock:
+            if key in self.items:
+                self.bytes -= self.items.pop(key)[1]
+            self.items[key] = (value, size)
+            self.bytes += size
+            while len(self.items) > 1 and \
+                  ((self.max_items is not None and len(self.items) > self.max_items) or
+                   (self.max_bytes is not None and self.bytes > self.max_bytes)):
+                old_key, old = self.items.popitem(last=False)
+                self.bytes -= old[1]
+
+    def clear(self):
+        """Remove all of the items"""
+        with self.lock:
+            self.items.clear()
+            self.bytes = 0
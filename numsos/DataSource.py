@@ -5,8 +5,13 @@ from builtins import object
 import numpy as np
 from sosdb import Sos
 from sosdb.DataSet import DataSet
-from numsos import Inputer
+from numsos import Inputer, Csv
+from numsos.Cache import ResultCache, query_generation
+from numsos.Group import TimeBuckets
+import concurrent.futures as cf
 import datetime as dt
+import itertools
+import json
 import time
 import os
 import sys
@@ -15,6 +20,9 @@ class DataSource(object):
 
     DEF_LIMIT     = 1024 * 1024
     DEF_COL_WIDTH = 16
+    DEF_CAPACITY  = 4096
+    DEF_PUT_BATCH = 4096
+    DEF_CSV_BLOCK = 65536
 
     """Implements a generic analysis Transform data source.
 
@@ -42,6 +50,13 @@ class DataSource(object):
         else:
             return default
 
+    def _keep_rows(self, result, keep):
+        """Copy the last keep rows of the last result to the start of result"""
+        last_size = self.last_result.get_series_size()
+        for col in range(0, result.series_count):
+            result.array(col)[0:keep] = \
+                self.last_result.array(col)[last_size-keep:last_size]
+
     def _get_idx(self, attr_name):
         return self.colnames.index(attr_name)
 
@@ -158,6 +173,71 @@ class DataSource(object):
                   end=' ', file=file)
         print("\n{0} record(s)".format(count), file=file)
 
+    def iter_results(self, chunk=None, wait=None, reset=True):
+        """Iterate over the data selected by select() as DataSets
+
+        Each iteration returns the next window of at most 'chunk'
+        records as a DataSet. Iteration stops when the data is
+        exhausted. Unlike calling get_results() in a loop and
+        concatenating each window to the previous result, no data is
+        copied. See concat_results() and Transform.collect() to
+        combine the windows into a single DataSet.
+
+        Keyword Parameters:
+
+        chunk -- The maximum number of records in each DataSet. If
+                 not specified, the limit is DataSource.window_size
+
+        wait  -- A wait-specification that indicates how to wait for
+                 results if the data available is less than
+                 'chunk'. See Sos.Query.query() for more information.
+
+        reset -- Set to True to re-start the query at the beginning of
+                 the matching data.
+        """
+        if chunk is None:
+            chunk = self.window
+        result = self.get_results(limit=chunk, wait=wait, reset=reset)
+        while result:
+            yield result
+            if wait is None and result.get_series_size() < chunk:
+                # A partial window means the data is exhausted
+                break
+            result = self.get_results(limit=chunk, wait=wait, reset=False)
+
+    def get_buckets(self, series_list, start, end, width=None, count=None,
+                    time_name='timestamp', chunk=None):
+        """Aggregate the selected data into time buckets
+
+        The data is read one window at a time and each window is
+        added to the buckets, so only the count, sum, minimum and
+        maximum of each bucket is kept rather than all of the data.
+
+        Positional Parameters:
+        -- The list of series names to aggregate
+        -- The start of the time range in seconds
+        -- The end of the time range in seconds
+
+        Keyword Parameters:
+        width     -- The width of a bucket in seconds
+        count     -- The number of buckets if width is not specified
+        time_name -- The name of the timestamp series
+        chunk     -- The maximum number of records read at a time
+
+        Returns:
+        A numsos.Group.TimeBuckets or None if there is no data
+        """
+        buckets = TimeBuckets(start, end, width=width, count=count)
+        rows = 0
+        for result in self.iter_results(chunk=chunk):
+            size = result.get_series_size()
+            buckets.add(result.array(time_name)[0:size],
+                        { name : result.array(name)[0:size] for name in series_list })
+            rows += size
+        if rows == 0:
+            return None
+        return buckets
+
     def get_results(self, limit=None, wait=None, reset=True, keep=0,
                     inputer=None):
 
@@ -189,6 +269,26 @@ class DataSource(object):
         """
         raise NotImplemented()
 
+    def get_df(self, limit=None, wait=None, reset=True, keep=0, index=None):
+        """Return a Pandas DataFrame from the DataSource
+
+        The get_df() method returns the data identified by the
+        select() method as a Pandas DataFrame. The DataFrame columns
+        are the series of get_results() wrapped without copying.
+
+        Keyword Parameters:
+
+        index -- The column name to use as the DataFrame index
+
+        See get_results() for the remaining parameters.
+        """
+        result = self.get_results(limit=limit, wait=wait, reset=reset, keep=keep)
+        if result is None:
+            return None
+        names = result.series
+        return Inputer.to_dataframe(names, [ result.array(name) for name in names ],
+                                    result.get_series_size(), index=index)
+
 class CsvDataSource(DataSource):
 
     """Implements a CSV file analysis Transform data source."""
@@ -342,6 +442,18 @@ class CsvDataSource(DataSource):
         if columns is None or columns[0] == '*':
             columns = self.colnames
         DataSource.select(self, columns)
+        # Whether each column is converted with float and can be parsed
+        # in bulk as double. A ColSpec with any other converter, e.g.
+        # int which must stay exact above 2**53, or whose converter
+        # cannot be read is converted by the ColSpec.
+        self.bulk_cols = []
+        for col in columns:
+            if str == type(col):
+                self.bulk_cols.append(True)
+            elif hasattr(col, 'cvt_fn'):
+                self.bulk_cols.append(col.cvt_fn in (None, float))
+            else:
+                self.bulk_cols.append(False)
         for c in self.columns:
             idx = self.colnames.index(c.col_name)
             c.update(self, 0, Csv.Attr(self.schema, c.col_name, idx, Sos.TYPE_DOUBLE))
@@ -375,23 +487,64 @@ class CsvDataSource(DataSource):
             return None
         if limit is None:
             limit = self.window
-        if inputer is None:
-            inp = Inputer.Default(self, limit, start=keep)
-        else:
-            inp = inputer
         if keep and self.last_result is None:
             raise ValueError("Cannot keep results from an empty previous result.")
-        count = self.query_(inp, reset=reset, wait=wait)
-        result = inp.to_dataset()
+        if inputer is None and self._bulk_columns():
+            result = self._bulk_results(limit, reset, keep)
+        else:
+            if inputer is None:
+                inp = Inputer.Default(self, limit, start=keep, grow=True)
+            else:
+                inp = inputer
+            count = self.query_(inp, reset=reset, wait=wait)
+            result = inp.get_results()
         if keep:
-            last_row = self.last_result.get_series_size() - keep
-            for row in range(0, keep):
-                for col in range(0, result.series_count):
-                    result[col, row] = self.last_result[col, last_row]
-                last_row += 1
+            self._keep_rows(result, keep)
         self.last_result = result
         return self.last_result
 
+    def _bulk_columns(self):
+        """Return True if the selected columns can be parsed as double
+
+        The columns are parsed in bulk unless a column was selected
+        with a converter other than float, see select().
+        """
+        return all(self.bulk_cols)
+
+    def _bulk_results(self, limit, reset, keep):
+        """Parse up to limit - keep records into a DataSet
+
+        The records are read DEF_CSV_BLOCK lines at a time and each
+        block is parsed with numpy.loadtxt() into a double array of
+        the selected columns only.
+        """
+        if reset:
+            self.reset()
+        usecols = [ self.colnames.index(col.col_name) for col in self.columns ]
+        blocks = []
+        count = 0
+        limit -= keep
+        while count < limit:
+            lines = list(itertools.islice(self.fp, min(limit - count, self.DEF_CSV_BLOCK)))
+            if len(lines) == 0:
+                break
+            block = np.loadtxt(lines, dtype=np.float64, comments='#',
+                               delimiter=self.separator, usecols=usecols, ndmin=2)
+            blocks.append(block)
+            count += len(block)
+        if count + keep == 0:
+            return None
+        result = DataSet()
+        for col_no in range(0, len(self.columns)):
+            nda = np.empty([ keep + count ], dtype=np.float64)
+            row = keep
+            for block in blocks:
+                nda[row:row+len(block)] = block[:,col_no]
+                row += len(block)
+            result.append_array(keep + count, self.columns[col_no].col_name, nda)
+        result.set_series_size(keep + count)
+        return result
+
 class InfluxDataSource(DataSource):
     """Implement a Influx DB anaylsis Transform data source"""
     def __init__(self):
@@ -498,11 +651,7 @@ class InfluxDataSource(DataSource):
         count = self.query_(inp, reset=reset, wait=wait)
         result = inp.to_dataset()
         if keep:
-            last_row = self.last_result.get_series_size() - keep
-            for row in range(0, keep):
-                for col in range(0, result.series_count):
-                    result[col, row] = self.last_result[col, last_row]
-                last_row += 1
+            self._keep_rows(result, keep)
         self.last_result = result
 
 class SosDataSource(DataSource):
@@ -521,6 +670,9 @@ class SosDataSource(DataSource):
         self.query_ = None
         self.put_map = {}
         self.ColSpec = Sos.ColSpec
+        self.follow_ = None
+        self.cache = None
+        self.cache_hit = False
 
     def reset(self):
         pass
@@ -536,9 +688,15 @@ class SosDataSource(DataSource):
         Keyword Arguments:
         path      - The path to the Sos container
         cont      - A Sos.Container handle
+        cache     - A directory or ResultCache in which complete
+                    query results are cached, see numsos.Cache. The
+                    cache is only used if 'path' is specified.
         """
         self.path = self._get_arg('path', kwargs, required=False)
         self.cont = self._get_arg('cont', kwargs, required=False)
+        self.cache = self._get_arg('cache', kwargs, required=False)
+        if self.cache is not None and not isinstance(self.cache, ResultCache):
+            self.cache = ResultCache(self.cache)
         if self.path == None and self.cont == None:
             raise ValueError("One of 'cont' or 'path' must be specified")
         if self.path:
@@ -785,6 +943,9 @@ class SosDataSource(DataSource):
                            where=where, from_ = from_,
                            order_by = order_by, desc = desc,
                            unique = unique)
+        self.select_spec = ([ col if type(col) == str else col.col_name for col in columns ],
+                            where, from_, order_by, desc, unique)
+        self.cache_hit = False
 
         col_no = 0
         self.colnames = []
@@ -792,6 +953,103 @@ class SosDataSource(DataSource):
             self.colnames.append(col.attr_name)
             col_no += 1
 
+    def parallel_select(self, columns, partition_by, partitions, where=None,
+                        order_by=None, desc=False, from_=None, unique=False,
+                        workers=None, executor='thread'):
+        """Query partitions of the data concurrently
+
+        The selection is split into one query for each partition,
+        which are run concurrently and merged into a single DataSet.
+        The queries run on a thread pool by default, and the Sos
+        query releases the GIL while it searches the container, or
+        on a process pool.
+
+        The merged result is in partition order, ascending by the
+        partition values, or descending if desc is True. If the
+        order_by index is ordered by the partition_by attribute first,
+        the result is in the same order as a single query.
+
+        Positional Parameters:
+
+        -- A list of column-specifications, see select()
+
+        -- The name of the attribute the data is partitioned by, for
+           example 'component_id' or 'timestamp'
+
+        -- A list of partitions. A partition is a value, which
+           selects the rows where the attribute is equal to the
+           value, or a tuple ( lo, hi ), which selects the rows where
+           lo <= attribute < hi. Timestamp partitions must be ranges.
+
+        Keyword Parameters:
+
+        where     -- An array of query conditions applied to every
+                     partition
+
+        workers   -- The maximum number of concurrent queries. The
+                     default is the executor's default.
+
+        executor  -- 'thread' or 'process'. A process executor
+                     requires that the DataSource was configured with
+                     a 'path'.
+
+        See select() for the from_, order_by, desc and unique
+        keywords.
+
+        Returns:
+
+        A DataSet or None if no data matched. The query of this
+        DataSource is not changed.
+
+        Example:
+
+            ds.parallel_select([ 'timestamp', 'component_id', 'MemFree' ],
+                               'component_id', [ 10001, 10002, 10003 ],
+                               from_    = [ 'meminfo' ],
+                               where    = [ [ 'job_id', Sos.COND_EQ, 1234 ] ],
+                               order_by = 'comp_time')
+        """
+        if executor == 'thread':
+            pool = cf.ThreadPoolExecutor(max_workers=workers)
+            cont = self.cont
+        elif executor == 'process':
+            if not self.path:
+                raise ValueError("A process executor requires a DataSource "
+                                 "configured with a 'path'")
+            pool = cf.ProcessPoolExecutor(max_workers=workers)
+            cont = self.path
+        else:
+            raise ValueError("The executor must be 'thread' or 'process'")
+
+        if where is None:
+            where = []
+        partitions = sorted(partitions, reverse=desc,
+                            key=lambda part: part[0] if type(part) == tuple else part)
+        with pool:
+            futures = []
+            for part in partitions:
+                if type(part) == tuple:
+                    cond = [ [ partition_by, Sos.COND_GE, part[0] ],
+                             [ partition_by, Sos.COND_LT, part[1] ] ]
+                else:
+                    cond = [ [ partition_by, Sos.COND_EQ, part ] ]
+                futures.append(pool.submit(_select_partition, cont, columns,
+                                           list(where) + cond, order_by, desc,
+                                           from_, unique))
+            results = [ f.result() for f in futures ]
+
+        results = [ res for res in results if res is not None ]
+        if len(results) == 0:
+            return None
+        total = sum([ len(res[0][1]) for res in results ])
+        result = DataSet()
+        for col in range(0, len(results[0])):
+            name = results[0][col][0]
+            result.append_array(total, name,
+                                np.concatenate([ res[col][1] for res in results ]))
+        result.set_series_size(total)
+        return result
+
     def col_by_name(self, name):
         return self.query_.col_by_name(name)
 
@@ -835,19 +1093,71 @@ class SosDataSource(DataSource):
             limit = self.window
         if keep and self.last_result is None:
             raise ValueError("Cannot keep results from an empty previous result.")
-        if inputer is None:
-            inputer = Sos.QueryInputer(self.query_, limit, start=keep)
-        count = self.query_.query(inputer, reset=reset, wait=wait)
-        result = self.query_.to_dataset()
+        if inputer is None and wait is None and not keep and self.cache and self.path:
+            result = self._cached_results(limit, reset)
+        elif inputer is None and wait is None:
+            result = self._grow_results(limit, reset, keep)
+        else:
+            if inputer is None:
+                inputer = Sos.QueryInputer(self.query_, limit, start=keep)
+            count = self.query_.query(inputer, reset=reset, wait=wait)
+            result = self.query_.to_dataset()
         if keep:
-            last_row = self.last_result.get_series_size() - keep
-            for row in range(0, keep):
-                for col in range(0, result.series_count):
-                    result[col, row] = self.last_result[col, last_row]
-                last_row += 1
+            self._keep_rows(result, keep)
         self.last_result = result
         return self.last_result
 
+    def _cached_results(self, limit, reset):
+        """Return the result from the cache or query and cache it
+
+        Only a complete result, i.e. one with fewer than limit rows,
+        is cached. The series of a cached result are read-only.
+        """
+        if not reset:
+            if self.cache_hit:
+                # The cached result was all of the data
+                return None
+            return self._grow_results(limit, reset, 0)
+        spec = (self.path,) + self.select_spec + (limit,)
+        key = self.cache.key(spec)
+        generation = query_generation(self.path, self.select_spec[1])
+        result = self.cache.get(key, generation)
+        self.cache_hit = result is not None
+        if result is None:
+            result = self._grow_results(limit, reset, 0)
+            if result is not None and result.get_series_size() < limit:
+                self.cache.put(key, spec, result, generation)
+        return result
+
+    def _grow_results(self, limit, reset, keep):
+        """Query up to limit rows into geometrically growing windows
+
+        The first window has room for DEF_CAPACITY rows and each
+        following window is twice the size of the previous one, so a
+        query that returns a few rows does not allocate series for
+        limit rows. The windows are concatenated into one DataSet
+        sized to the rows returned.
+        """
+        results = []
+        window = min(limit, keep + self.DEF_CAPACITY)
+        start = keep
+        remaining = limit
+        while remaining > 0:
+            inputer = Sos.QueryInputer(self.query_, window, start=start)
+            self.query_.query(inputer, reset=reset)
+            result = self.query_.to_dataset()
+            if result is None:
+                break
+            results.append(result)
+            size = result.get_series_size()
+            remaining -= size
+            if size < window:
+                break
+            reset = False
+            start = 0
+            window = min(remaining, 2 * window)
+        return concat_results(results)
+
     def get_df(self, limit=None, wait=None, reset=True, keep=0, index=None, inputer=None):
 
         """Return a Pandas DataFrame from the DataSource
@@ -877,25 +1187,161 @@ class SosDataSource(DataSource):
                  large series of input data, the last sample from the
                  previous window needs to be subtracted from the first
                  sample of the next window (see Transform.diff())
+
+        inputer -- An inputer to query the data with, in which case
+                   the DataFrame is built by the Sos query. By
+                   default the series from get_results() are wrapped
+                   in the DataFrame without copying.
         """
-        if self.query is None:
+        if self.query_ is None:
             return None
-        if limit is None:
-            limit = self.window
-        if keep and self.last_result is None:
-            raise ValueError("Cannot keep results from an empty previous result.")
         if inputer is None:
-            inputer = Sos.QueryInputer(self.query_, limit, start=keep)
-        count = self.query_.query(inputer, reset=reset, wait=wait)
-        result = self.query_.to_dataframe(index=index)
+            return DataSource.get_df(self, limit=limit, wait=wait, reset=reset,
+                                     keep=keep, index=index)
         if keep:
-            last_row = self.last_result.get_series_size() - keep
-            for row in range(0, keep):
-                for col in range(0, result.series_count):
-                    result[col, row] = self.last_result[col, last_row]
-                last_row += 1
-        self.last_result = result
-        return self.last_result
+            raise ValueError("The keep parameter is not supported with an inputer.")
+        count = self.query_.query(inputer, reset=reset, wait=wait)
+        return self.query_.to_dataframe(index=index)
+
+    def follow(self, columns, key, where=None, order_by=None, from_=None,
+               cursor=None, start=None, keep=0):
+        """Follow the data added to the container
+
+        Select the data like select(), but each call to poll()
+        returns only the rows whose key attribute is greater than the
+        largest key seen by the previous poll(). This replaces
+        re-scanning a trailing time window, e.g. timestamp >= now-60,
+        each time new data is wanted.
+
+        Positional Parameters:
+
+        -- A list of column-specifications, see select()
+
+        -- The name of the key attribute, which must increase as data
+           is added, e.g. 'timestamp'. The column-specification must
+           include the key and order_by should be an index ordered by
+           the key first. Rows added later with a key equal to the
+           largest key already seen are not returned.
+
+        Keyword Parameters:
+
+        cursor -- The path to a file in which the largest key returned
+                  is saved by commit(). If the file exists, the follow
+                  resumes from the key in the file, so that a restarted
+                  process does not re-read or miss data.
+
+        start  -- The key to start after if there is no cursor file.
+                  The default is to start with the first row.
+
+        keep   -- The number of rows of the previous poll() to return
+                  in front of the new rows, e.g. 1 to continue a
+                  diff() across polls. The rows are retained in a
+                  ring buffer, see poll().
+
+        See select() for the where, order_by and from_ keywords.
+        """
+        self.follow_ = { "columns" : columns, "key" : key,
+                         "where" : list(where) if where else [],
+                         "order_by" : order_by, "from_" : from_,
+                         "cursor" : cursor }
+        self.follow_key = start
+        if cursor and os.path.exists(cursor):
+            with open(cursor) as f:
+                state = json.load(f)
+            if state['key'] != key:
+                raise ValueError("The cursor {0} follows {1}, not {2}".\
+                                 format(cursor, state['key'], key))
+            self.follow_key = state['value']
+            if type(self.follow_key) == list:
+                self.follow_key = tuple(self.follow_key)
+        self.follow_ring = _Ring(keep) if keep else None
+
+    def poll(self, limit=None):
+        """Return the rows added since the last poll()
+
+        See follow(). If keep was specified, the first keep rows of
+        the result are the last rows of the previous poll. The
+        series of the result are then views of the ring buffer and
+        are only valid until the next poll().
+
+        If there are more than limit new rows, the rows with the
+        largest key of the result are left for the next poll(), since
+        the rows after limit may have the same key, e.g. the other
+        components sampled at the same time. If all limit rows have
+        the same key, the limit is doubled until there is a row with
+        a different key.
+
+        The cursor file is not updated, call commit() once the rows
+        have been used.
+
+        Keyword Parameters:
+
+        limit -- The maximum number of new rows to return, the
+                 default is DataSource.window_size. The remaining rows
+                 are returned by the next poll().
+
+        Returns:
+
+        A DataSet or None if there are no new rows
+        """
+        if self.follow_ is None:
+            raise ValueError("poll() requires a follow()")
+        spec = self.follow_
+        key = spec['key']
+        where = list(spec['where'])
+        if self.follow_key is not None:
+            where.append([ key, Sos.COND_GT, self.follow_key ])
+        if limit is None:
+            limit = self.window
+        while True:
+            self.select(spec['columns'], where=where,
+                        order_by=spec['order_by'], from_=spec['from_'])
+            result = self.get_results(limit=limit)
+            if result is None:
+                return None
+            size = result.get_series_size()
+            keys = result.array(key)[0:size]
+            if size < limit:
+                break
+            # The rows are ordered by key, drop the rows with the last
+            # key, the next poll() reads all of them
+            size = int(np.searchsorted(keys, keys[-1], side='left'))
+            if size > 0:
+                trimmed = DataSet()
+                for name in result.series:
+                    trimmed.append_array(size, name, result.array(name)[0:size])
+                trimmed.set_series_size(size)
+                result = trimmed
+                break
+            limit *= 2
+        last = keys[size-1]
+        if np.issubdtype(last.dtype, np.datetime64):
+            usecs = int(last.astype('datetime64[us]').astype(np.int64))
+            self.follow_key = (usecs // 1000000, usecs % 1000000)
+        else:
+            self.follow_key = last.item()
+        if self.follow_ring:
+            result = self.follow_ring.append(result)
+            self.last_result = result
+        return result
+
+    def commit(self):
+        """Save the key of the last poll() in the cursor file
+
+        Call commit() after the rows returned by poll() have been
+        used, e.g. written to another schema, so that a process that
+        is restarted after a failure polls the rows again instead of
+        losing them. Does nothing if follow() has no cursor.
+        """
+        if self.follow_ is None:
+            raise ValueError("commit() requires a follow()")
+        cursor = self.follow_['cursor']
+        if not cursor or self.follow_key is None:
+            return
+        tmp = cursor + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({ "key" : self.follow_['key'], "value" : self.follow_key }, f)
+        os.replace(tmp, cursor)
 
     def insert(self, key, schema_name, mapping):
         """Insert data from a dataset into a container
@@ -925,11 +1371,13 @@ class SosDataSource(DataSource):
         }
 
         The "series-name" is the name of the series in the DataSet to
-        be stored. The "attr-name" is an attribute name in the object
-        schema. The optional "cvt-fn" is the name of a Python method
-        that will be used process each entry in the series before
-        storing it in the object. If not present, the value from the
-        dataset series will be stored without modification.
+        be stored, the default is the "attr-name". The "attr-name" is
+        an attribute name in the object schema. The optional "cvt-fn"
+        is the name of a Python method that will be used process each
+        entry in the series before storing it in the object. A numpy
+        ufunc is applied to the whole series at once. If not present,
+        the value from the dataset series will be stored without
+        modification.
 
         If a series from the dataset is not present in the map, it
         will not be stored in the object.
@@ -965,7 +1413,7 @@ class SosDataSource(DataSource):
                break
 
         """
-        if "key" in self.put_map:
+        if key in self.put_map:
             raise ValueError("A mapping named {0} already exists".format(key))
 
         schema = self.cont.schema_by_name(schema_name)
@@ -976,6 +1424,7 @@ class SosDataSource(DataSource):
         key_list = []
         obj_cols = np.zeros([ len(mapping) ], np.dtype(int))
         cvt_fns = []
+        series = []
         col = 0
         for m in mapping:
             # Each entry is the
@@ -985,13 +1434,14 @@ class SosDataSource(DataSource):
                                  format(m['attr-name'], schema_name))
 
             obj_cols[col] = attr.attr_id()
-            if 'cvt_fn' in m:
-                cvt_fns.append(m['cvt_fn'])
+            series.append(m.get('series-name', m['attr-name']))
+            cvt_fn = m.get('cvt-fn', m.get('cvt_fn'))
+            if cvt_fn is not None:
                 key_map['cvt'] = True
-            else:
-                cvt_fns.append(None)
+            cvt_fns.append(cvt_fn)
             col += 1
         key_map['obj_cols'] = obj_cols
+        key_map['series'] = series
         key_map['cvt_fns'] = cvt_fns
         self.put_map[key] = key_map
 
@@ -999,41 +1449,37 @@ class SosDataSource(DataSource):
         schema = self.cont.schema_by_name(schema_name)
         return schema
 
-    def put_results(self, ins_key, results):
+    def put_results(self, ins_key, results, batch=None):
         """Save DataSet results.
 
+        The objects are written in batches. The objects in a batch
+        are allocated and assigned their values first and then added
+        to the schema indices together. If an object cannot be
+        allocated or assigned, the rows before it are stored and the
+        exception is raised.
+
         Parameters:
         - The 'key' that was specified to the insert() function
         - The results to store
+
+        Keyword Parameters:
+        batch -- The number of objects in a batch, the default is
+                 DEF_PUT_BATCH
         """
         if ins_key not in self.put_map:
             raise ValueError("The {0} mapping is not present, did you do "\
                              "an insert()?".format(ins_key))
 
         mapping = self.put_map[ins_key]
-        obj_cols = mapping['obj_cols']
-        col_count = len(obj_cols)
-        cvt_fns = mapping['cvt_fns']
+        columns = [ results.array(name) for name in mapping['series'] ]
+        self._put_columns(mapping, columns, results.get_series_size(), batch)
 
-        ds_cols = []
-        for col in range(0, col_count):
-            ds_cols.append(results.array(col))
-
-        schema = mapping['schema']
-        for row_no in range(0, results.get_series_size()):
-            obj = schema.alloc()
-            if not obj:
-                raise MemoryError("An object could not be allocated")
-            for col in range(0, col_count):
-                if cvt_fns[col] is None:
-                    obj[obj_cols[col]] = ds_cols[col][row_no]
-                else:
-                    obj[obj_cols[col]] = cvt_fns(ds_cols[col][row_no])
-            obj.index_add()
-
-    def put_df(self, ins_key, results):
+    def put_df(self, ins_key, results, batch=None):
         """Save DataFrame results.
 
+        The DataFrame index is stored if its name is one of the
+        series names in the mapping. See put_results().
+
         Parameters:
         - The 'key' that was specified to the insert() function
         - The results to store
@@ -1043,22 +1489,154 @@ class SosDataSource(DataSource):
                              "an insert()?".format(ins_key))
 
         mapping = self.put_map[ins_key]
-        obj_cols = mapping['obj_cols']
-        col_count = len(obj_cols)
-        cvt_fns = mapping['cvt_fns']
+        columns = []
+        for name in mapping['series']:
+            if name not in results.columns and name == results.index.name:
+                columns.append(results.index.to_numpy())
+            else:
+                columns.append(results[name].to_numpy())
+        self._put_columns(mapping, columns, len(results), batch)
+
+    def _put_columns(self, mapping, columns, count, batch):
+        """Store count rows of the column arrays as objects"""
+        if batch is None:
+            batch = self.DEF_PUT_BATCH
+        obj_cols = mapping['obj_cols'].tolist()
+        values = []
+        for nda, cvt_fn in zip(columns, mapping['cvt_fns']):
+            nda = nda[0:count]
+            if cvt_fn is not None:
+                if isinstance(cvt_fn, np.ufunc):
+                    nda = cvt_fn(nda)
+                else:
+                    nda = np.frompyfunc(cvt_fn, 1, 1)(nda)
+            if nda.dtype.kind in 'biuf':
+                # Python scalars are assigned faster than numpy scalars
+                values.append(nda.tolist())
+            else:
+                values.append(nda)
+        cols = list(zip(obj_cols, values))
 
-        records = results.to_records()
         schema = mapping['schema']
-        for row_no in range(0, len(results)):
-            obj = schema.alloc()
-            if not obj:
-                raise MemoryError("An object could not be allocated")
-            for col in range(0, col_count):
-                if cvt_fns[col] is None:
-                    obj[obj_cols[col]] = records[row_no][col]
-                else:
-                    obj[obj_cols[col]] = cvt_fns(records[row_no][col])
-            obj.index_add()
+        for first in range(0, count, batch):
+            objs = []
+            try:
+                for row_no in range(first, min(count, first + batch)):
+                    obj = schema.alloc()
+                    if not obj:
+                        raise MemoryError("An object could not be allocated")
+                    try:
+                        for attr_id, vals in cols:
+                            obj[attr_id] = vals[row_no]
+                    except:
+                        # A partially assigned object is not stored
+                        obj.delete()
+                        raise
+                    objs.append(obj)
+            finally:
+                # Index the objects assigned before a failure, an
+                # object that is not indexed cannot be found
+                for obj in objs:
+                    obj.index_add()
+
+class _Ring(object):
+    """Retain the last rows of each result in front of the next one
+
+    The rows of each result are copied once into a buffer for each
+    series after the rows retained from the previous result. When the
+    buffer is full, only the retained rows are moved to the front of
+    the buffer.
+    """
+    def __init__(self, keep):
+        self.keep = keep
+        self.bufs = None
+        self.capacity = 0
+        self.head = 0
+        self.tail = 0
+
+    def append(self, result):
+        """Return a DataSet of the retained rows followed by result"""
+        size = result.get_series_size()
+        names = result.series
+        retained = min(self.keep, self.tail - self.head)
+        start = self.tail - retained
+        if self.bufs is None or retained + size > self.capacity:
+            self.capacity = 2 * (self.keep + size)
+            bufs = {}
+            for name in names:
+                src = result.array(name)
+                bufs[name] = np.empty((self.capacity,) + src.shape[1:], dtype=src.dtype)
+                if retained:
+                    bufs[name][0:retained] = self.bufs[name][start:self.tail]
+            self.bufs = bufs
+            start = 0
+        elif self.tail + size > self.capacity:
+            for name in names:
+                self.bufs[name][0:retained] = self.bufs[name][start:self.tail]
+            start = 0
+        tail = start + retained
+        for name in names:
+            self.bufs[name][tail:tail+size] = result.array(name)[0:size]
+        self.head = start
+        self.tail = tail + size
+        ds = DataSet()
+        for name in names:
+            ds.append_array(self.tail - start, name, self.bufs[name][start:self.tail])
+        ds.set_series_size(self.tail - start)
+        return ds
+
+def _select_partition(cont, columns, where, order_by, desc, from_, unique):
+    """Query one partition for SosDataSource.parallel_select()
+
+    The container is a Sos.Container or, in a worker process, the
+    path to the container. The series are returned as a list of
+    ( name, array ) so that the result can be pickled.
+    """
+    src = SosDataSource()
+    if type(cont) == str:
+        src.config(path=cont)
+    else:
+        src.config(cont=cont)
+    src.select(columns, where=where, order_by=order_by, desc=desc,
+               from_=from_, unique=unique)
+    result = concat_results(list(src.iter_results()))
+    if result is None:
+        return None
+    size = result.get_series_size()
+    return [ (name, result.array(name)[0:size]) for name in result.series ]
+
+def concat_results(results):
+    """Concatenate a list of DataSets into a single DataSet
+
+    The series in the result are allocated once at their final size
+    and each input DataSet is copied into place, so the cost is linear
+    in the total number of rows. The series in the result are those
+    of the first DataSet in the list.
+
+    Positional Parameters:
+    -- A list of DataSets, for example from DataSource.iter_results()
+
+    Returns:
+    A DataSet or None if the list is empty
+    """
+    if len(results) == 0:
+        return None
+    if len(results) == 1:
+        return results[0]
+    sizes = [ res.get_series_size() for res in results ]
+    total = sum(sizes)
+    result = DataSet()
+    for name in results[0].series:
+        src = results[0].array(name)
+        typ = np.result_type(*[ res.array(name).dtype for res in results ])
+        nda = np.empty((total,) + src.shape[1:], dtype=typ)
+        row = 0
+        for res, size in zip(results, sizes):
+            nda[row:row+size] = res.array(name)[0:size]
+            row += size
+        result.append_array(total, name, nda)
+    result.set_series_size(total)
+    return result
 
 def datasource(name, path=None, create=False, mode=0o660):
     """
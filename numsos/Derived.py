@@ -0,0 +1,187 @@
+from builtins import object
+import numpy as np
+import ast
+
+class DerivedMetrics(object):
+    """Compute derived series from arithmetic expressions
+
+    The derived series are specified as a dictionary of series name
+    to expression, for example:
+
+        { 'mem_acc' : 'ld_ins + sr_ins',
+          'cpi'     : 'tot_cyc / tot_ins',
+          'uopi'    : 'mem_acc / tot_ins' }
+
+    An expression may use the input series, the series derived
+    before it in the dictionary, numbers, the + - * / ** operators
+    and the functions abs, sqrt, log, exp, minimum and maximum. A
+    derived series may replace an input series of the same name,
+    e.g. { 'tot_ins' : 'tot_ins / bin_width' }, in which case the
+    expressions after it use the derived series and the expressions
+    before it use the input series.
+
+    The expressions are compiled once. A subexpression that appears
+    more than once, for example (l1_icm + l1_dcm) in two miss rates,
+    is computed once. The rows are evaluated a chunk at a time so
+    that the temporary arrays stay in the cache, and the result of
+    each expression is written directly into its output array.
+    Division by zero results in inf or nan rather than a warning.
+
+    Positional Parameters:
+    -- The dictionary of series name to expression
+
+    Keyword Parameters:
+    chunk   -- The number of rows evaluated at a time, the default is
+               DEF_CHUNK
+    numexpr -- If True and the numexpr module is installed, each
+               expression is evaluated with numexpr.evaluate()
+               instead. The expressions must then be valid numexpr
+               expressions.
+    """
+    DEF_CHUNK = 16384
+
+    OPERATORS = {
+        ast.Add : np.add,
+        ast.Sub : np.subtract,
+        ast.Mult : np.multiply,
+        ast.Div : np.true_divide,
+        ast.Pow : np.power,
+    }
+
+    FUNCTIONS = {
+        'abs' : np.absolute,
+        'sqrt' : np.sqrt,
+        'log' : np.log,
+        'exp' : np.exp,
+        'minimum' : np.minimum,
+        'maximum' : np.maximum,
+    }
+
+    def __init__(self, spec, chunk=None, numexpr=False):
+        if chunk is None:
+            chunk = self.DEF_CHUNK
+        self.chunk = chunk
+        self.spec = spec
+        self.names = list(spec.keys())
+        self.inputs = []
+        self.trees = {}
+        for name in self.names:
+            try:
+                tree = ast.parse(spec[name], mode='eval').body
+            except SyntaxError:
+                raise ValueError("The expression for {0} is not valid: {1}".\
+                                 format(name, spec[name]))
+            self.trees[name] = self._compile(name, tree)
+
+        # A subexpression used more than once is computed once
+        uses = {}
+        for name in self.names:
+            self._count(self.trees[name], uses)
+        self.shared = set([ node for node in uses if uses[node] > 1 ])
+
+        self.numexpr = None
+        if numexpr:
+            try:
+                import numexpr as ne
+                self.numexpr = ne
+            except ImportError:
+                pass
+
+    def _compile(self, name, node):
+        """Return the expression as nested tuples
+
+        A tuple is ( 'input', series-name ), ( 'derived', series-name ),
+        ( 'const', value ) or ( 'op', ufunc, operand, ... ).
+        """
+        if isinstance(node, ast.BinOp) and type(node.op) in self.OPERATORS:
+            return ( 'op', self.OPERATORS[type(node.op)],
+                     self._compile(name, node.left), self._compile(name, node.right) )
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return ( 'op', np.negative, self._compile(name, node.operand) )
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.UAdd):
+            return self._compile(name, node.operand)
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            return ( 'const', float(node.value) )
+        if isinstance(node, ast.Name):
+            if node.id in self.trees:
+                return ( 'derived', node.id )
+            if node.id not in self.inputs:
+                self.inputs.append(node.id)
+            return ( 'input', node.id )
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) \
+           and node.func.id in self.FUNCTIONS and not node.keywords:
+            return ( 'op', self.FUNCTIONS[node.func.id] ) + \
+                tuple([ self._compile(name, arg) for arg in node.args ])
+        raise ValueError("The expression for {0} contains an unsupported "
+                         "operation: {1}".format(name, self.spec[name]))
+
+    def _count(self, node, uses):
+        if node[0] != 'op':
+            return
+        uses[node] = uses.get(node, 0) + 1
+        if uses[node] == 1:
+            for arg in node[2:]:
+                self._count(arg, uses)
+
+    def _eval(self, node, inputs, outputs, memo, out=None):
+        kind = node[0]
+        if kind == 'input':
+            return inputs[node[1]]
+        if kind == 'derived':
+            return outputs[node[1]]
+        if kind == 'const':
+            return node[1]
+        if node in memo:
+            return memo[node]
+        args = [ self._eval(arg, inputs, outputs, memo) for arg in node[2:] ]
+        if node in self.shared or out is None:
+            res = node[1](*args)
+        else:
+            res = node[1](*args, out=out)
+        if node in self.shared:
+            memo[node] = res
+        return res
+
+    def evaluate(self, data, size=None):
+        """Compute the derived series
+
+        Positional Parameters:
+        -- A DataSet or a dictionary of series name to numpy array
+           containing the input series
+
+        Keyword Parameters:
+        size -- The number of rows. The default is the DataSet series
+                size or the length of the arrays.
+
+        Returns:
+        A dictionary of series name to numpy array
+        """
+        if hasattr(data, 'get_series_size'):
+            if size is None:
+                size = data.get_series_size()
+            inputs = { name : data.array(name)[0:size] for name in self.inputs }
+        else:
+            if size is None:
+                size = len(data[self.inputs[0]]) if self.inputs else 0
+            inputs = { name : np.asarray(data[name])[0:size] for name in self.inputs }
+
+        outputs = { name : np.empty([ size ]) for name in self.names }
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            if self.numexpr:
+                local = dict(inputs)
+                for name in self.names:
+                    self.numexpr.evaluate(self.spec[name], local_dict=local,
+                                          out=outputs[name], casting='unsafe')
+                    local[name] = outputs[name]
+                return outputs
+            for start in range(0, size, self.chunk):
+                end = min(size, start + self.chunk)
+                chunk_in = { name : inputs[name][start:end] for name in inputs }
+                chunk_out = { name : outputs[name][start:end] for name in outputs }
+                memo = {}
+                for name in self.names:
+                    out = chunk_out[name]
+                    res = self._eval(self.trees[name], chunk_in, chunk_out, memo, out=out)
+                    if res is not out:
+                        out[:] = res
+        return outputs
@@ -0,0 +1,323 @@
+from builtins import object
+import numpy as np
+
+class Groups(object):
+    """Partition the rows of a DataSet into groups of equal value
+
+    The rows are ordered by the group series once with a stable sort,
+    or not at all if the rows are already in order, for example
+    because the query was ordered by an index on the group series. A
+    group is then a contiguous segment of the ordered rows and the
+    transforms are computed over all of the segments at once with the
+    numpy reduceat kernels instead of masking the input for each
+    group value.
+
+    If more than one group series is given, the rows are grouped by
+    the combination of the values, e.g. [ 'job_id', 'component_id' ]
+    results in a group for each component of each job.
+
+    The groups are in ascending order of the group value(s), which is
+    the same order as numpy.unique(). Within a group the rows are in
+    the same order as the input.
+
+    Positional Parameters:
+    -- The group series as a numpy array or a list of numpy arrays
+
+    Keyword Parameters:
+    size -- The number of rows in the series. The default is the
+            length of the array(s).
+    """
+    def __init__(self, keys, size=None):
+        if type(keys) not in (list, tuple):
+            keys = [ keys ]
+        if size is None:
+            size = len(keys[0])
+        self.size = size
+        keys = [ self._key(nda[0:size]) for nda in keys ]
+
+        # in_order[i] is True if row i+1 is not less than row i
+        in_order = None
+        for nda in reversed(keys):
+            if in_order is None:
+                in_order = nda[1:] >= nda[:-1]
+            else:
+                in_order = (nda[1:] > nda[:-1]) | \
+                           ((nda[1:] == nda[:-1]) & in_order)
+        if size < 2 or np.all(in_order):
+            self.order = None
+        elif len(keys) == 1:
+            self.order = np.argsort(keys[0], kind='stable')
+        else:
+            # lexsort uses the last key as the primary key
+            self.order = np.lexsort(keys[::-1])
+        if size == 0:
+            self.starts = np.zeros([ 0 ], dtype=np.int64)
+        else:
+            change = np.zeros([ size - 1 ], dtype=bool)
+            for nda in keys:
+                if self.order is not None:
+                    nda = nda[self.order]
+                change |= nda[1:] != nda[:-1]
+            change = np.nonzero(change)[0] + 1
+            self.starts = np.concatenate(([ 0 ], change)).astype(np.int64)
+        self.counts = np.diff(np.append(self.starts, size))
+
+    def _key(self, nda):
+        if nda.ndim > 1:
+            # Array valued keys, e.g. strings stored as byte
+            # arrays, are replaced with their rank
+            uniq, codes = np.unique(nda, axis=0, return_inverse=True)
+            return codes.reshape(-1)
+        return nda
+
+    def __len__(self):
+        """Return the number of groups"""
+        return len(self.starts)
+
+    def take(self, nda):
+        """Return the series ordered by group"""
+        nda = nda[0:self.size]
+        if self.order is None:
+            return nda
+        return nda[self.order]
+
+    def first(self, nda, lengths):
+        """Return the first lengths[g] rows of each group g
+
+        This is used to select the rows of the series that are
+        copied unmodified to the result of a transform. The lengths
+        may not be greater than the group sizes.
+        """
+        src = self.take(nda)
+        total = int(np.sum(lengths))
+        ends = np.cumsum(lengths)
+        rows = np.repeat(self.starts - (ends - lengths), lengths) + np.arange(total)
+        return src[rows]
+
+    def _bcast(self, counts, nda):
+        return counts.reshape((-1,) + (1,) * (nda.ndim - 1))
+
+    def apply(self, xfrm_fn, nda, **kwargs):
+        """Apply a transform to each group of the series
+
+        The numpy sum, mean, min, max, std, and diff functions are
+        computed over all groups at once. Any other function is
+        called once for each group with the group's rows.
+
+        Positional Parameters:
+        -- The transform function, e.g. numpy.sum
+        -- The series as a numpy array
+
+        Keyword Parameters:
+        **kwargs -- Passed to the transform function
+
+        Returns:
+        The result of each group concatenated together in group order
+        """
+        src = self.take(nda)
+        axis = kwargs.get('axis', 0)
+        if axis != 0:
+            # The transform is within a row, the group only
+            # determines the order of the rows
+            return xfrm_fn(src, **kwargs)
+        args = set(kwargs.keys()) - set([ 'axis' ])
+        if len(self) == 0:
+            pass
+        elif xfrm_fn is np.sum and not args:
+            return np.add.reduceat(src, self.starts, axis=0)
+        elif xfrm_fn is np.min and not args:
+            return np.minimum.reduceat(src, self.starts, axis=0)
+        elif xfrm_fn is np.max and not args:
+            return np.maximum.reduceat(src, self.starts, axis=0)
+        elif xfrm_fn is np.mean and not args:
+            return np.add.reduceat(src, self.starts, axis=0) / self._bcast(self.counts, src)
+        elif xfrm_fn is np.std and not args - set([ 'ddof' ]):
+            ddof = kwargs.get('ddof', 0)
+            mean = np.add.reduceat(src, self.starts, axis=0) / self._bcast(self.counts, src)
+            dev = src - np.repeat(mean, self.counts, axis=0)
+            var = np.add.reduceat(dev * dev, self.starts, axis=0) / \
+                  self._bcast(self.counts - ddof, src)
+            return np.sqrt(var)
+        elif xfrm_fn is np.diff and not args:
+            # Difference the whole series and drop the rows that
+            # straddle two groups
+            res = np.diff(src, axis=0)
+            keep = np.ones([ len(res) ], dtype=bool)
+            keep[self.starts[1:] - 1] = False
+            return res[keep]
+        res = []
+        for start, count in zip(self.starts, self.counts):
+            r = np.asarray(xfrm_fn(src[start:start+count], **kwargs))
+            if r.ndim < src.ndim:
+                # A reduction, one row for the group
+                r = r.reshape((1,) + r.shape)
+            res.append(r)
+        if len(res) == 0:
+            return src[0:0]
+        return np.concatenate(res)
+
+class TimeBuckets(object):
+    """Aggregate series into fixed width time buckets
+
+    The data is added one chunk at a time and only the count, sum,
+    minimum and maximum of each bucket is retained, so the input
+    never needs to be held in memory at once. The minimum, mean and
+    maximum of every series are computed in the same pass. A value
+    that is not finite, e.g. a NaN for a missing sample, is not
+    included in the statistics of its series.
+
+    Positional Parameters:
+    -- The start of the time range in seconds
+    -- The end of the time range in seconds
+
+    Keyword Parameters:
+    width -- The width of a bucket in seconds
+    count -- The number of buckets, e.g. Grafana's maxDataPoints. This
+             is used to compute the width if width is not specified.
+    """
+    def __init__(self, start, end, width=None, count=None):
+        if width is None:
+            if not count:
+                raise ValueError("One of width or count must be specified")
+            width = max(1.0, float(end - start) / count)
+        self.start = float(start)
+        self.width = float(width)
+        self.size = max(1, int(np.ceil((end - start) / self.width)))
+        self.counts = np.zeros([ self.size ], dtype=np.int64)
+        self.sums = {}
+        self.mins = {}
+        self.maxs = {}
+        self.valid = {}
+
+    def _seconds(self, timestamps):
+        timestamps = np.asarray(timestamps)
+        if np.issubdtype(timestamps.dtype, np.datetime64):
+            return timestamps.astype('datetime64[us]').astype(np.int64) / 1.0e6
+        return timestamps.astype(np.float64)
+
+    def add(self, timestamps, series):
+        """Add a chunk of data
+
+        Positional Parameters:
+        -- The timestamps as datetime64 or seconds
+        -- A dictionary of series name to numpy array
+        """
+        idx = np.floor((self._seconds(timestamps) - self.start) / self.width)
+        rows = (idx >= 0) & (idx < self.size)
+        idx = idx[rows].astype(np.intp)
+        self.counts += np.bincount(idx, minlength=self.size)
+        for name, nda in series.items():
+            nda = np.asarray(nda, dtype=np.float64)[rows]
+            if name not in self.sums:
+                self.sums[name] = np.zeros([ self.size ])
+                self.mins[name] = np.full([ self.size ], np.inf)
+                self.maxs[name] = np.full([ self.size ], -np.inf)
+                self.valid[name] = np.zeros([ self.size ], dtype=np.int64)
+            finite = np.isfinite(nda)
+            if np.all(finite):
+                vidx = idx
+            else:
+                vidx = idx[finite]
+                nda = nda[finite]
+            self.valid[name] += np.bincount(vidx, minlength=self.size)
+            self.sums[name] += np.bincount(vidx, weights=nda, minlength=self.size)
+            np.minimum.at(self.mins[name], vidx, nda)
+            np.maximum.at(self.maxs[name], vidx, nda)
+
+    def times(self):
+        """Return the start time in seconds of the non-empty buckets"""
+        return self.start + np.nonzero(self.counts)[0] * self.width
+
+    def count(self):
+        """Return the number of rows in each non-empty bucket"""
+        return self.counts[self.counts > 0]
+
+    def _finite(self, name, nda):
+        # A bucket without a finite value of the series is NaN
+        used = self.counts > 0
+        return np.where(self.valid[name][used] > 0, nda[used], np.nan)
+
+    def min(self, name):
+        return self._finite(name, self.mins[name])
+
+    def max(self, name):
+        return self._finite(name, self.maxs[name])
+
+    def sum(self, name):
+        return self.sums[name][self.counts > 0]
+
+    def mean(self, name):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self._finite(name, self.sums[name] / self.valid[name])
+
+def group_diff(keys, nda):
+    """Return the difference of each row from the previous row of its group
+
+    This is the same as a pandas groupby(keys).diff().fillna(0): the
+    result is in the order of the input rows, the first row of each
+    group is 0 and a NaN difference is 0.
+
+    Positional Parameters:
+    -- The group series as a numpy array or a list of numpy arrays
+    -- The series as a numpy array, or a 2-D array with a column for
+       each series
+    """
+    nda = np.asarray(nda, dtype=np.float64)
+    groups = Groups(keys, size=len(nda))
+    src = groups.take(nda)
+    res = np.zeros(src.shape)
+    res[1:] = src[1:] - src[:-1]
+    res[groups.starts] = 0
+    res[np.isnan(res)] = 0
+    if groups.order is None:
+        return res
+    out = np.empty(res.shape)
+    out[groups.order] = res
+    return out
+
+def bin_sum(times, weights, bins, range=None):
+    """Sum the weights in equal width time bins
+
+    The bins are the same as those of numpy.histogram(times,
+    bins=bins, range=range, weights=weights): the last bin includes
+    its right edge. The bin of each row is computed once and, if
+    weights is a 2-D array, every column is summed with one
+    numpy.bincount.
+
+    Positional Parameters:
+    -- The times as numbers
+    -- The weights as a numpy array, or a 2-D array with a column for
+       each series
+    -- The number of bins
+
+    Keyword Parameters:
+    range -- The (lower, upper) range of the bins, the default is the
+             minimum and maximum of the times
+
+    Returns:
+    ( sums, edges ) where sums has a row for each bin and edges has
+    bins + 1 values
+    """
+    times = np.asarray(times, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    if range is None:
+        if len(times):
+            range = (np.min(times), np.max(times))
+        else:
+            range = (0.0, 1.0)
+    lo, hi = float(range[0]), float(range[1])
+    if lo == hi:
+        lo -= 0.5
+        hi += 0.5
+    edges = np.linspace(lo, hi, bins + 1)
+    idx = np.searchsorted(edges, times, side='right') - 1
+    idx[times == hi] = bins - 1
+    rows = (idx >= 0) & (idx < bins)
+    idx = idx[rows]
+    weights = weights[rows]
+    if weights.ndim == 1:
+        return np.bincount(idx, weights=weights, minlength=bins), edges
+    cols = weights.shape[1]
+    flat = (idx[:, np.newaxis] * cols + np.arange(cols)).reshape(-1)
+    sums = np.bincount(flat, weights=weights.reshape(-1), minlength=bins * cols)
+    return sums.reshape(bins, cols), edges
@@ -12,89 +12,257 @@ import os
 import struct
 import sys
 
+# The column kinds written directly to the column buffers by Default.input()
+cdef enum:
+    KIND_OBJECT = 0
+    KIND_INT16
+    KIND_INT32
+    KIND_INT64
+    KIND_UINT16
+    KIND_UINT32
+    KIND_UINT64
+    KIND_FLOAT
+    KIND_DOUBLE
+    KIND_TIMESTAMP
+
+def column_type(typ, as_double=False):
+    """Return the numpy type string and input kind for a Sos type
+
+    Integer types keep their native width and sign unless as_double
+    is True, in which case they are stored as double.
+    """
+    if typ == Sos.TYPE_TIMESTAMP:
+        return 'datetime64[us]', KIND_TIMESTAMP
+    elif typ == Sos.TYPE_STRUCT:
+        return 'uint8', KIND_OBJECT
+    elif typ == Sos.TYPE_DOUBLE:
+        return 'double', KIND_DOUBLE
+    elif typ == Sos.TYPE_FLOAT:
+        return 'float32', KIND_FLOAT
+    elif as_double and typ in (Sos.TYPE_UINT64, Sos.TYPE_UINT32, Sos.TYPE_UINT16,
+                               Sos.TYPE_INT64, Sos.TYPE_INT32, Sos.TYPE_INT16):
+        return 'double', KIND_DOUBLE
+    elif typ == Sos.TYPE_UINT64:
+        return 'uint64', KIND_UINT64
+    elif typ == Sos.TYPE_UINT32:
+        return 'uint32', KIND_UINT32
+    elif typ == Sos.TYPE_UINT16:
+        return 'uint16', KIND_UINT16
+    elif typ == Sos.TYPE_INT64:
+        return 'int64', KIND_INT64
+    elif typ == Sos.TYPE_INT32:
+        return 'int32', KIND_INT32
+    elif typ == Sos.TYPE_INT16:
+        return 'int16', KIND_INT16
+    typ_str = Sos.sos_type_strs[typ].lower()
+    return typ_str.replace('_array', ''), KIND_OBJECT
+
+cdef char *buffer_addr(data):
+    cdef unsigned char[::1] mv
+    if data.size == 0:
+        return NULL
+    mv = data.reshape(-1).view(np.uint8)
+    return <char *>&mv[0]
+
 cdef class Default(object):
-    DEF_ARRAY_LIMIT = 256
+    DEF_ARRAY_WIDTH = 16
+    DEF_CAPACITY = 4096
     cdef long start
     cdef long row_count
     cdef long limit
-    cdef long array_limit
+    cdef long capacity
+    cdef int col_count
+    cdef int *kinds
+    cdef char **bufs
     cdef query
-    cdef dataset
+    cdef list columns
+    cdef list arrays
+
+    def __cinit__(self, *args, **kwargs):
+        self.col_count = 0
+        self.kinds = NULL
+        self.bufs = NULL
+
+    def __dealloc__(self):
+        free(self.kinds)
+        free(self.bufs)
+
+    def __init__(self, query, limit, start=0, as_double=False,
+                 grow=False, array_limit=None):
+        """Input query rows into a DataSet
+
+        Each column is stored in a numpy array of the column's native
+        type. Numeric and timestamp values are written directly to the
+        array's buffer. If as_double is True, integer columns are
+        stored as double.
 
-    def __init__(self, query, limit, start=0):
+        The native integer types only apply to rows input through
+        this class from a query with integer columns. SosDataSource
+        reads with Sos.QueryInputer, which does its own conversion,
+        and the CsvDataSource columns are double.
+
+        If grow is True, the arrays start with room for DEF_CAPACITY
+        rows and double in size as rows are input up to the limit
+        instead of being allocated for limit rows up front. The
+        series of the result are trimmed to the number of rows input.
+
+        Array and string columns start with array_limit elements per
+        row and are widened to fit longer values as they are input.
+        The array_limit is either a number or a dictionary of column
+        name to number; the default is DEF_ARRAY_WIDTH.
+        """
         cdef int typ
+        cdef int col_no
         cdef typ_str
         cdef col
 
         self.start = start
         self.row_count = start
         self.limit = limit
-        self.array_limit = self.DEF_ARRAY_LIMIT
+        if grow:
+            self.capacity = min(limit, start + self.DEF_CAPACITY)
+        else:
+            self.capacity = limit
         self.query = query
-        self.dataset = DataSet()
-        for col in self.query.get_columns():
+        self.arrays = []
+        self.columns = self.query.get_columns()
+        self.col_count = len(self.columns)
+        self.kinds = <int *>malloc(self.col_count * sizeof(int))
+        self.bufs = <char **>malloc(self.col_count * sizeof(char *))
+        if self.col_count and (self.kinds == NULL or self.bufs == NULL):
+            raise MemoryError("The column buffers could not be allocated")
+        col_no = 0
+        for col in self.columns:
             typ = col.attr_type
-            if typ == Sos.TYPE_TIMESTAMP:
-                typ_str = 'datetime64[us]'
-            elif typ == Sos.TYPE_STRUCT:
-                typ_str = 'uint8'
-            elif typ == Sos.TYPE_UINT64:
-                typ_str = 'double'
-            elif typ == Sos.TYPE_UINT32:
-                typ_str = 'double'
-            elif typ == Sos.TYPE_INT64:
-                typ_str = 'double'
-            elif typ == Sos.TYPE_INT32:
-                typ_str = 'double'
-            else:
-                typ_str = Sos.sos_type_strs[typ].lower()
-                typ_str = typ_str.replace('_array', '')
-
+            typ_str, kind = column_type(typ, as_double)
             if typ >= Sos.TYPE_IS_ARRAY:
+                kind = KIND_OBJECT
+                if type(array_limit) == dict:
+                    width = array_limit.get(col.col_name, self.DEF_ARRAY_WIDTH)
+                elif array_limit:
+                    width = array_limit
+                else:
+                    width = self.DEF_ARRAY_WIDTH
                 if typ == Sos.TYPE_STRING:
-                    data = np.zeros([ self.limit ],
-                                    dtype=np.dtype('|S{0}'.format(self.DEF_ARRAY_LIMIT)))
+                    data = np.zeros([ self.capacity ],
+                                    dtype=np.dtype('|S{0}'.format(width)))
                 else:
-                    data = np.zeros([ self.limit, self.array_limit],
+                    data = np.zeros([ self.capacity, width ],
                                     dtype=np.dtype(typ_str))
             else:
-                data = np.zeros([ self.limit ], dtype=np.dtype(typ_str))
-            col.set_data(data)
-            self.dataset.append_array(self.limit, [ col.col_name ], data)
+                data = np.zeros([ self.capacity ], dtype=np.dtype(typ_str))
+            self.kinds[col_no] = kind
+            self.arrays.append(None)
+            self._set_array(col_no, data)
+            col_no += 1
         self.reset(start=start)
 
+    cdef _set_array(self, int col_no, data):
+        self.arrays[col_no] = data
+        if self.kinds[col_no] == KIND_OBJECT:
+            self.bufs[col_no] = NULL
+        else:
+            self.bufs[col_no] = buffer_addr(data)
+        self.columns[col_no].set_data(data)
+
+    cdef _grow(self):
+        """Double the row capacity of the arrays up to the limit"""
+        cdef int col_no
+        capacity = min(self.limit, 2 * self.capacity)
+        for col_no in range(self.col_count):
+            data = self.arrays[col_no]
+            new = np.zeros((capacity,) + data.shape[1:], dtype=data.dtype)
+            new[0:self.row_count] = data[0:self.row_count]
+            self._set_array(col_no, new)
+        self.capacity = capacity
+
+    cdef _widen(self, int col_no, long width):
+        """Widen an array or string column to at least width elements"""
+        data = self.arrays[col_no]
+        if data.ndim > 1:
+            width = max(width, 2 * data.shape[1])
+            new = np.zeros([ self.capacity, width ], dtype=data.dtype)
+            new[0:self.row_count,:data.shape[1]] = data[0:self.row_count]
+        else:
+            width = max(width, 2 * data.dtype.itemsize)
+            new = data.astype(np.dtype('|S{0}'.format(width)))
+        self._set_array(col_no, new)
+        return new
+
     def reset(self, start=0):
         if start:
             self.row_count = start
         else:
             self.row_count = self.start
 
-    def input(self, row):
-        cdef long typ
+    def input(self, query, row):
+        """Store a row of column values
 
-        for col in self.query.get_columns():
-            typ = col.attr_type
-            a = col.value
-            array = col.get_data()
-            if col.is_array or typ == Sos.TYPE_STRUCT:
-                if typ != Sos.TYPE_STRING:
-                    array[self.row_count,:len(a)] = a
-                else:
-                    array[self.row_count] = a
-            elif typ == Sos.TYPE_TIMESTAMP:
-                array[self.row_count] = (a[0] * 1000000) + a[1]
+        Positional Parameters:
+        -- The query the row is from
+        -- A sequence of values, one for each column
+
+        Returns:
+        False if the result is full, True otherwise
+        """
+        cdef int col_no
+        cdef int kind
+        cdef long r = self.row_count
+        cdef char *buf
+
+        if r == self.capacity:
+            self._grow()
+        for col_no in range(self.col_count):
+            a = row[col_no]
+            kind = self.kinds[col_no]
+            buf = self.bufs[col_no]
+            if kind == KIND_DOUBLE:
+                (<double *>buf)[r] = a
+            elif kind == KIND_TIMESTAMP:
+                (<int64_t *>buf)[r] = (<int64_t>a[0]) * 1000000 + <int64_t>a[1]
+            elif kind == KIND_UINT64:
+                (<uint64_t *>buf)[r] = a
+            elif kind == KIND_INT64:
+                (<int64_t *>buf)[r] = a
+            elif kind == KIND_UINT32:
+                (<uint32_t *>buf)[r] = a
+            elif kind == KIND_INT32:
+                (<int32_t *>buf)[r] = a
+            elif kind == KIND_FLOAT:
+                (<float *>buf)[r] = a
+            elif kind == KIND_UINT16:
+                (<uint16_t *>buf)[r] = a
+            elif kind == KIND_INT16:
+                (<int16_t *>buf)[r] = a
             else:
-                array[self.row_count] = a
+                array = self.arrays[col_no]
+                if array.ndim > 1:
+                    if len(a) > array.shape[1]:
+                        array = self._widen(col_no, len(a))
+                    array[r,:len(a)] = a
+                else:
+                    if array.dtype.kind == 'S' and len(a) > array.dtype.itemsize:
+                        array = self._widen(col_no, len(a))
+                    array[r] = a
         self.row_count += 1
         if self.row_count == self.limit:
             return False
         return True
 
     def get_results(self):
+        """Return a DataSet of the rows input
+
+        The series are views of the column arrays trimmed to the
+        number of rows.
+        """
         if self.row_count == 0:
             return None
-        self.dataset.set_series_size(self.row_count)
-        return self.dataset
+        dataset = DataSet()
+        for col, data in zip(self.columns, self.arrays):
+            dataset.append_array(self.row_count, [ col.col_name ],
+                                 data[0:self.row_count])
+        dataset.set_series_size(self.row_count)
+        return dataset
 
 class TableInputer(object):
     def __init__(self, query, limit, file=sys.stdout):
@@ -148,102 +316,70 @@ class TableInputer(object):
             return False
         return True
 
-cdef class PandasDataFrame(object):
-    DEF_ARRAY_LIMIT = 256
-    cdef long start
-    cdef long row_count
-    cdef long limit
-    cdef long array_limit
-    cdef query
-    cdef dataframe
+def to_dataframe(names, arrays, count, index=None):
+    """Wrap column arrays in a pandas DataFrame without copying them
 
-    def __init__(self, query, limit, index=None, freq='1s', start=0):
-        cdef int typ
-        cdef typ_str
-        cdef col
+    Positional Parameters:
+    -- The list of column names
+    -- The list of numpy arrays, one for each column
+    -- The number of rows
 
-        import pandas as pd
-        self.start = start
-        self.row_count = start
-        self.limit = limit
-        self.array_limit = self.DEF_ARRAY_LIMIT
-        self.query = query
-        self.dataframe = pd.DataFrame()
-        columns = []
-        series = []
-        for col in self.query.get_columns():
-            typ = col.attr_type
-            if typ == Sos.TYPE_TIMESTAMP:
-                typ_str = 'datetime64[us]'
-            elif typ == Sos.TYPE_STRUCT:
-                typ_str = 'uint8'
-            elif typ == Sos.TYPE_UINT64:
-                typ_str = 'double'
-            elif typ == Sos.TYPE_UINT32:
-                typ_str = 'double'
-            elif typ == Sos.TYPE_INT64:
-                typ_str = 'double'
-            elif typ == Sos.TYPE_INT32:
-                typ_str = 'double'
-            else:
-                typ_str = Sos.sos_type_strs[typ].lower()
-                typ_str = typ_str.replace('_array', '')
+    Keyword Parameters:
+    index -- The name of the column to use as the DataFrame index,
+             for example the timestamp. The column is not also
+             included in the DataFrame columns.
 
-            if typ >= Sos.TYPE_IS_ARRAY:
-                if typ == Sos.TYPE_STRING:
-                    data = np.zeros([ self.limit ],
-                                    dtype=np.dtype('|S{0}'.format(self.DEF_ARRAY_LIMIT)))
-                else:
-                    data = np.zeros([ self.limit, self.array_limit],
-                                    dtype=np.dtype(typ_str))
-            else:
-                data = np.zeros([ self.limit ], dtype=np.dtype(typ_str))
-            columns.append(col.col_name)
-            if typ == Sos.TYPE_TIMESTAMP:
-                df = pd.DataFrame(index=data, columns=col.col_name)
-            else:
-                df = pd.DataFrame(data, columns=col.col_name)
-            series.append(df)
-            #self.dataframe = self.dataframe.append(data=data, columns=col.col_name)
-        self.dataframe = self.dataframe.merge(series)
+    Array columns, which have more than one dimension, are stored as
+    a column of objects each of which is a view of a row of the array.
+    """
+    import pandas as pd
+    data = {}
+    idx = None
+    for name, nda in zip(names, arrays):
+        nda = nda[0:count]
+        if name == index:
+            idx = pd.Index(nda, name=name, copy=False)
+            continue
+        if nda.ndim > 1:
+            col = np.empty([ count ], dtype=object)
+            col[:] = list(nda)
+            nda = col
+        data[name] = nda
+    if index is not None and idx is None:
+        raise ValueError("The index column {0} is not in the "
+                         "result.".format(index))
+    return pd.DataFrame(data, index=idx, columns=[ n for n in names if n != index ],
+                        copy=False)
 
-    def reset(self, start=0):
-        if start:
-            self.row_count = start
-        else:
-            self.row_count = self.start
+cdef class PandasDataFrame(Default):
+    cdef index
 
-    def to_df(self):
-        if self.row_count == 0:
-            return None
-        # self.dataset.set_series_size(self.row_count)
-        return self.dataframe
+    def __init__(self, query, limit, index=None, freq='1s', start=0,
+                 as_double=False, grow=False, array_limit=None):
+        """Input query rows into a pandas DataFrame
 
-    '''
-    def input(self, row):
-        cdef long typ
+        The rows are stored in numpy column arrays as by Default,
+        which are wrapped in a DataFrame once, without copying, when
+        the result is requested.
 
-        for col in self.query.get_columns():
-            typ = col.attr_type
-            a = col.value
-            array = col.get_data()
-            if col.is_array or typ == Sos.TYPE_STRUCT:
-                if typ != Sos.TYPE_STRING:
-                    array[self.row_count,:len(a)] = a
-                else:
-                    array[self.row_count] = a
-            elif typ == Sos.TYPE_TIMESTAMP:
-                array[self.row_count] = (a[0] * 1000000) + a[1]
-            else:
-                array[self.row_count] = a
-        self.row_count += 1
-        if self.row_count == self.limit:
-            return False
-        return True
+        Keyword Parameters:
+        index -- The name of the column to use as the DataFrame
+                 index, for example 'timestamp'
+        freq  -- Accepted for compatibility, the index is not
+                 resampled
+
+        See Default for the remaining parameters.
+        """
+        Default.__init__(self, query, limit, start=start, as_double=as_double,
+                         grow=grow, array_limit=array_limit)
+        self.index = index
 
     def get_results(self):
+        """Return a DataFrame of the rows input"""
         if self.row_count == 0:
             return None
-        # self.dataset.set_series_size(self.row_count)
-        return self.dataframe
-    '''
+        return to_dataframe([ col.col_name for col in self.columns ],
+                            self.arrays, self.row_count, index=self.index)
+
+    def to_df(self):
+        return self.get_results()
@@ -0,0 +1,189 @@
+from builtins import object
+import numpy as np
+from sosdb import Sos
+from numsos.DataSource import SosDataSource, concat_results
+from numsos.Cache import LruCache, container_path
+from numsos.Group import Groups
+
+class JobInfoResolver(object):
+    """Look up the job records of many jobs at once
+
+    A job schema such as 'mt-slurm' has a record for each rank of a
+    job. lookup() reads the records of a list of jobs with one range
+    scan of the job_id index for each run of nearby job_id, instead of
+    a query for each job, and reduces the records of each job to one.
+    A series is reduced with the function in the reduce dictionary,
+    by default the job_start is the minimum and the job_end the
+    maximum, and the other series are the value of the first record.
+
+    A completed job, i.e. one whose records all have a job_end, does
+    not change, so its record is kept in an LRU cache and is not read
+    again. The cache may be shared by several resolvers, for example
+    by the analyses created for each Grafana request.
+
+    Positional Parameters:
+    -- The container
+
+    Keyword Parameters:
+    schema   -- The job schema, the default is 'mt-slurm'
+    columns  -- The series of the record, the default is DEF_COLUMNS.
+                The job_id is always included.
+    order_by -- An index ordered by job_id first, the default is
+                'job_rank_time'
+    reduce   -- A dictionary of series name to the function that
+                reduces the series of each job, e.g. numpy.min
+    max_gap  -- Jobs whose job_id differ by no more than max_gap are
+                read with the same range scan, the default is
+                DEF_MAX_GAP
+    cache    -- An LruCache, the default is a cache of DEF_CACHE_JOBS
+                jobs for this resolver
+
+    Example:
+
+        jobs = JobInfoResolver(cont)
+        info = jobs.lookup([ 1234, 1235, 2001 ])
+        for job_id in info:
+            print(job_id, info[job_id]['job_name'])
+    """
+    DEF_COLUMNS = [ 'job_id', 'job_name', 'job_user', 'job_size',
+                    'job_start', 'job_end' ]
+    DEF_REDUCE = { 'job_start' : np.min, 'job_end' : np.max }
+    DEF_MAX_GAP = 64
+    DEF_CACHE_JOBS = 65536
+
+    def __init__(self, cont, schema='mt-slurm', columns=None,
+                 order_by='job_rank_time', reduce=None, max_gap=None,
+                 cache=None):
+        self.cont = cont
+        self.schema = schema
+        if columns is None:
+            columns = self.DEF_COLUMNS
+        self.columns = [ 'job_id' ] + [ col for col in columns if col != 'job_id' ]
+        self.order_by = order_by
+        if reduce is None:
+            reduce = self.DEF_REDUCE
+        self.reduce = reduce
+        if max_gap is None:
+            max_gap = self.DEF_MAX_GAP
+        self.max_gap = max_gap
+        if cache is None:
+            cache = LruCache(max_items=self.DEF_CACHE_JOBS)
+        self.cache = cache
+        self.key = (container_path(cont), schema, tuple(self.columns))
+
+    def lookup(self, job_ids):
+        """Return the records of a list of jobs
+
+        Positional Parameters:
+        -- A list of job_id
+
+        Returns:
+        A dictionary of job_id to the record of the job, a dictionary
+        of series name to value. A job that is not found is not in
+        the result.
+        """
+        result = {}
+        missing = []
+        for job_id in job_ids:
+            job_id = int(job_id)
+            rec = self.cache.get((self.key, job_id))
+            if rec is not None:
+                result[job_id] = rec
+            else:
+                missing.append(job_id)
+        if len(missing) == 0:
+            return result
+
+        for run in job_id_runs(missing, self.max_gap):
+            records, complete = self._scan(run)
+            for job_id, rec in records.items():
+                result[job_id] = rec
+                if job_id in complete:
+                    self.cache.put((self.key, job_id), rec)
+        return result
+
+    def get(self, job_id):
+        """Return the record of one job or None if it is not found"""
+        return self.lookup([ job_id ]).get(int(job_id))
+
+    def _scan(self, job_ids):
+        """Read and reduce the records of the sorted job_ids
+
+        Returns:
+        ( records, complete ) where records is a dictionary of job_id
+        to record and complete is the set of job_id that completed
+        """
+        src = SosDataSource()
+        src.config(cont=self.cont)
+        src.select(self.columns,
+                   from_    = [ self.schema ],
+                   where    = job_id_where(job_ids),
+                   order_by = self.order_by)
+        # A job has a record per component, read every window
+        data = concat_results(list(src.iter_results()))
+        if data is None:
+            return {}, set()
+        size = data.get_series_size()
+        jobs = data.array('job_id')[0:size].astype(np.int64)
+        rows = np.nonzero(np.isin(jobs, job_ids))[0]
+        if len(rows) == 0:
+            return {}, set()
+
+        groups = Groups(jobs[rows])
+        values = {}
+        for name in self.columns:
+            nda = data.array(name)[0:size][rows]
+            if name in self.reduce:
+                values[name] = groups.apply(self.reduce[name], nda)
+            else:
+                values[name] = groups.take(nda)[groups.starts]
+        job_ids = values['job_id'].astype(np.int64)
+        if 'job_end' in self.columns:
+            ends = groups.apply(np.min, data.array('job_end')[0:size][rows])
+            complete = set(job_ids[ends > 0].tolist())
+        else:
+            complete = set(job_ids.tolist())
+        records = {}
+        for row in range(len(groups)):
+            rec = {}
+            for name in self.columns:
+                value = values[name][row]
+                rec[name] = value.item() if hasattr(value, 'item') and \
+                            np.ndim(value) == 0 else value
+            records[int(job_ids[row])] = rec
+        return records, complete
+
+def job_id_runs(job_ids, max_gap=None):
+    """Split a list of job_id into runs of nearby job_id
+
+    Each run can be read with one range scan of a job_id index, see
+    job_id_where(), without reading the jobs between runs.
+
+    Positional Parameters:
+    -- A list of job_id
+
+    Keyword Parameters:
+    max_gap -- The largest difference between consecutive job_id in
+               a run, the default is JobInfoResolver.DEF_MAX_GAP
+
+    Returns:
+    A list of sorted numpy arrays of unique job_id
+    """
+    if max_gap is None:
+        max_gap = JobInfoResolver.DEF_MAX_GAP
+    job_ids = np.unique(np.asarray(job_ids, dtype=np.int64))
+    if len(job_ids) == 0:
+        return []
+    breaks = np.nonzero(np.diff(job_ids) > max_gap)[0] + 1
+    return np.split(job_ids, breaks)
+
+def job_id_where(run):
+    """Return the where conditions of a range scan of a run of job_id
+
+    Positional Parameters:
+    -- A sorted array of job_id, see job_id_runs()
+    """
+    if len(run) == 1:
+        return [ [ 'job_id', Sos.COND_EQ, int(run[0]) ] ]
+    return [ [ 'job_id', Sos.COND_GE, int(run[0]) ],
+             [ 'job_id', Sos.COND_LE, int(run[-1]) ] ]
@@ -0,0 +1,332 @@
+from builtins import object
+from collections import OrderedDict
+import numpy as np
+import time
+from sosdb import Sos
+from sosdb.DataSet import DataSet
+from numsos.DataSource import SosDataSource, concat_results
+from numsos.Derived import DerivedMetrics
+from numsos.Group import Groups
+
+SUMMARY_SUFFIX = '_job_summary'
+STATS = [ 'min', 'max', 'sum', 'sumsq' ]
+# How the statistics of two rollups are combined
+FOLD = { 'min' : np.minimum, 'max' : np.maximum, 'sum' : np.add, 'sumsq' : np.add }
+
+def summary_template(name, metrics):
+    """Return the schema template of a job summary
+
+    Each object is the rollup of the samples of one component of one
+    job over the interval [first, last]. See SosDataSource.add_schema()
+    for the template format.
+
+    Positional Parameters:
+    -- The name of the summary schema
+    -- A list of metric names
+    """
+    attrs = [
+        { "name" : "job_id", "type" : "uint64", "index" : {} },
+        { "name" : "component_id", "type" : "uint64" },
+        { "name" : "first", "type" : "double" },
+        { "name" : "last", "type" : "double", "index" : {} },
+        { "name" : "count", "type" : "uint64" },
+    ]
+    for metric in metrics:
+        for stat in STATS:
+            attrs.append({ "name" : metric + '_' + stat, "type" : "double" })
+    attrs.append({ "name" : "job_comp", "type" : "join",
+                   "join_attrs" : [ "job_id", "component_id" ],
+                   "index" : {} })
+    return { "name" : name, "attrs" : attrs }
+
+class JobSummarizer(object):
+    """Maintain per-job rollups of the samples in a schema
+
+    Each update() reads the samples added since the previous update,
+    see SosDataSource.follow(), and computes the rollup of each
+    (job_id, component_id) in the new samples: the count, the first
+    and last timestamp, and the min, max, sum and sum of squares of
+    each metric. The summary schema is created if it does not exist.
+
+    The summary schema has one object per (job_id, component_id). The
+    rollup of a job and component that already has an object is
+    folded into the object in place, so the summary grows with the
+    number of jobs and components and not with the number of updates.
+    JobSummary combines the objects of a job when they are read.
+
+    A summarizer resumes after the latest sample already in the
+    summary schema, so a restarted summarizer does not summarize a
+    sample twice even without a cursor file.
+
+    Positional Parameters:
+    -- The container
+    -- The name of the schema containing the samples
+    -- A list of metric names, or a dictionary of series name to
+       expression of the metrics, see Derived.DerivedMetrics
+
+    Keyword Parameters:
+    summary  -- The name of the summary schema, the default is the
+                sample schema name + SUMMARY_SUFFIX
+    cursor   -- The path to the file in which the timestamp of the last
+                summarized sample is saved after each update, see
+                SosDataSource.commit(). The summary schema is used if
+                it is further along.
+    order_by -- The name of an index of the sample schema ordered by
+                timestamp first, the default is 'time_job_comp'
+
+    Example:
+
+        summ = JobSummarizer(cont, 'meminfo',
+                             { 'Mem_Used_Ratio' :
+                               '(MemTotal - MemAvailable) / MemTotal' },
+                             cursor='/var/lib/numsos/meminfo.cursor')
+        summ.run(interval=60)
+    """
+    def __init__(self, cont, schema, metrics, summary=None, cursor=None,
+                 order_by='time_job_comp'):
+        if hasattr(metrics, 'keys'):
+            self.derived = DerivedMetrics(metrics)
+            self.metrics = list(self.derived.names)
+            inputs = self.derived.inputs
+        else:
+            self.derived = None
+            self.metrics = list(metrics)
+            inputs = self.metrics
+        if summary is None:
+            summary = schema + SUMMARY_SUFFIX
+        self.summary = summary
+
+        self.src = SosDataSource()
+        self.src.config(cont=cont)
+        if self.src.get_schema(summary) is None:
+            self.src.add_schema(summary_template(summary, self.metrics))
+        columns = [ 'timestamp', 'job_id', 'component_id' ]
+        columns += [ name for name in inputs if name not in columns ]
+        self.src.follow(columns, 'timestamp',
+                        where = [ [ 'job_id', Sos.COND_GT, 0 ] ],
+                        order_by = order_by, from_ = [ schema ],
+                        cursor = cursor)
+        last = self._last_summarized()
+        if last is not None and \
+           (self.src.follow_key is None or last > tuple(self.src.follow_key)):
+            self.src.follow_key = last
+        names = [ 'job_id', 'component_id', 'first', 'last', 'count' ]
+        for metric in self.metrics:
+            names += [ metric + '_' + stat for stat in STATS ]
+        self.src.insert(summary, summary,
+                        [ { "attr-name" : name } for name in names ])
+
+    def update(self, limit=None):
+        """Summarize the samples added since the last update
+
+        Keyword Parameters:
+        limit -- The maximum number of samples to summarize, the
+                 remaining samples are summarized by the next update
+
+        Returns:
+        The number of samples summarized
+        """
+        data = self.src.poll(limit=limit)
+        if data is None:
+            return 0
+        size = data.get_series_size()
+        if self.derived:
+            values = self.derived.evaluate(data, size)
+        else:
+            values = { name : data.array(name)[0:size] for name in self.metrics }
+
+        timestamps = data.array('timestamp')[0:size]
+        if np.issubdtype(timestamps.dtype, np.datetime64):
+            secs = timestamps.astype('datetime64[us]').astype(np.int64) / 1.0e6
+        else:
+            secs = timestamps.astype(np.float64)
+
+        groups = Groups([ data.array('job_id'), data.array('component_id') ], size)
+        cols = OrderedDict()
+        for name in [ 'job_id', 'component_id' ]:
+            cols[name] = groups.take(data.array(name))[groups.starts]
+        cols['first'] = groups.apply(np.min, secs)
+        cols['last'] = groups.apply(np.max, secs)
+        cols['count'] = groups.counts
+        for metric in self.metrics:
+            nda = np.asarray(values[metric], dtype=np.float64)
+            cols[metric + '_min'] = groups.apply(np.min, nda)
+            cols[metric + '_max'] = groups.apply(np.max, nda)
+            cols[metric + '_sum'] = groups.apply(np.sum, nda)
+            cols[metric + '_sumsq'] = groups.apply(np.sum, nda * nda)
+
+        rows = self._fold(cols)
+        if len(rows):
+            rollup = DataSet()
+            for name, nda in cols.items():
+                rollup.append_array(len(rows), name, nda[rows])
+            rollup.set_series_size(len(rows))
+            self.src.put_results(self.summary, rollup)
+        self.src.commit()
+        return size
+
+    def _fold(self, cols):
+        """Fold rollups into the summary objects of their job and component
+
+        Positional Parameters:
+        -- A dictionary of series name to numpy array of the rollups
+
+        Returns:
+        The row numbers of the rollups that have no summary object
+        """
+        schema = self.src.get_schema(self.summary)
+        job_attr = schema['job_id']
+        jobs = cols['job_id']
+        comps = cols['component_id']
+        new = np.ones([ len(jobs) ], dtype=bool)
+        for job in np.unique(jobs):
+            objs = {}
+            filt = Sos.Filter(job_attr)
+            filt.add_condition(job_attr, Sos.COND_EQ, int(job))
+            obj = filt.begin()
+            while obj is not None:
+                objs.setdefault(int(obj['component_id']), obj)
+                obj = filt.next()
+            del filt
+            for row in np.nonzero(jobs == job)[0]:
+                obj = objs.get(int(comps[row]))
+                if obj is None:
+                    continue
+                # 'last' is indexed, the object is removed from the
+                # indices while it is modified
+                obj.index_del()
+                try:
+                    obj['first'] = min(obj['first'], float(cols['first'][row]))
+                    obj['last'] = max(obj['last'], float(cols['last'][row]))
+                    obj['count'] = obj['count'] + int(cols['count'][row])
+                    for metric in self.metrics:
+                        for stat in STATS:
+                            name = metric + '_' + stat
+                            obj[name] = float(FOLD[stat](obj[name], cols[name][row]))
+                finally:
+                    obj.index_add()
+                new[row] = False
+        return np.nonzero(new)[0]
+
+    def _last_summarized(self):
+        """Return the timestamp of the latest summarized sample
+
+        Returns:
+        The largest 'last' in the summary schema as a (secs, usecs)
+        follow key or None if the summary is empty
+        """
+        self.src.select([ 'last' ], from_ = [ self.summary ],
+                        order_by = 'last', desc = True)
+        data = self.src.get_results(limit=1)
+        if data is None or data.get_series_size() == 0:
+            return None
+        usecs = int(round(float(data.array('last')[0]) * 1.0e6))
+        return (usecs // 1000000, usecs % 1000000)
+
+    def run(self, interval=None, limit=None):
+        """Summarize the samples until there are no more
+
+        Keyword Parameters:
+        interval -- If specified, wait interval seconds when there are
+                    no new samples and continue, i.e. run forever
+        limit    -- The maximum number of samples read at a time
+        """
+        while True:
+            if self.update(limit=limit) == 0:
+                if interval is None:
+                    break
+                time.sleep(interval)
+
+class JobSummary(object):
+    """Read the rollups maintained by a JobSummarizer
+
+    Positional Parameters:
+    -- The container
+    -- The name of the summary schema
+    """
+    def __init__(self, cont, summary):
+        self.src = SosDataSource()
+        self.src.config(cont=cont)
+        self.summary = summary
+
+    def exists(self):
+        """Return True if the summary schema is in the container"""
+        return self.src.get_schema(self.summary) is not None
+
+    def get_results(self, metrics, start=0, end=0, job_id=None,
+                    group_name=[ 'job_id', 'component_id' ]):
+        """Return the combined rollups
+
+        All of the matching rollups are read. The rollups of each group
+        are combined into one row with the series group_name, first, last, count and metric + '_min',
+        '_max', '_sum', '_mean' and '_std' for each metric.
+
+        Positional Parameters:
+        -- A list of metric names
+
+        Keyword Parameters:
+        start      -- Only rollups that end at or after start are used
+        end        -- Only rollups that begin at or before end are used
+        job_id     -- Only the rollups of this job are used
+        group_name -- The series by which the rollups are combined,
+                      e.g. 'job_id' for one row per job
+
+        Returns:
+        A DataSet or None if there are no rollups
+        """
+        where = []
+        if job_id is not None:
+            where.append([ 'job_id', Sos.COND_EQ, int(job_id) ])
+            order_by = 'job_comp'
+        else:
+            order_by = 'last'
+        if start > 0:
+            where.append([ 'last', Sos.COND_GE, float(start) ])
+        columns = [ 'job_id', 'component_id', 'first', 'last', 'count' ]
+        for metric in metrics:
+            columns += [ metric + '_' + stat for stat in STATS ]
+        self.src.select(columns, from_ = [ self.summary ],
+                        where = where, order_by = order_by)
+        data = concat_results(list(self.src.iter_results()))
+        if data is None:
+            return None
+        size = data.get_series_size()
+        rows = None
+        if end > 0:
+            rows = np.nonzero(data.array('first')[0:size] <= end)[0]
+            size = len(rows)
+            if size == 0:
+                return None
+
+        def series(name):
+            nda = data.array(name)[0:data.get_series_size()]
+            if rows is not None:
+                nda = nda[rows]
+            return nda
+
+        if type(group_name) not in (list, tuple):
+            group_name = [ group_name ]
+        groups = Groups([ series(name) for name in group_name ], size)
+        count = len(groups)
+        res = DataSet()
+        for name in group_name:
+            res.append_array(count, name, groups.take(series(name))[groups.starts])
+        res.append_array(count, 'first', groups.apply(np.min, series('first')))
+        res.append_array(count, 'last', groups.apply(np.max, series('last')))
+        n = groups.apply(np.sum, series('count')).astype(np.float64)
+        res.append_array(count, 'count', n)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for metric in metrics:
+                total = groups.apply(np.sum, series(metric + '_sum'))
+                sumsq = groups.apply(np.sum, series(metric + '_sumsq'))
+                mean = total / n
+                var = np.maximum(sumsq / n - mean * mean, 0.0)
+                res.append_array(count, metric + '_min',
+                                 groups.apply(np.min, series(metric + '_min')))
+                res.append_array(count, metric + '_max',
+                                 groups.apply(np.max, series(metric + '_max')))
+                res.append_array(count, metric + '_sum', total)
+                res.append_array(count, metric + '_mean', mean)
+                res.append_array(count, metric + '_std', np.sqrt(var))
+        res.set_series_size(count)
+        return res
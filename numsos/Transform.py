@@ -1,21 +1,48 @@
 import numpy as np
+import json
+import os
 from numsos.Stack import Stack
+from numsos.Group import Groups
+from numsos.Derived import DerivedMetrics
+from numsos.Cache import LruCache
 from sosdb.DataSet import DataSet
 from sosdb import Sos
-from numsos.DataSource import SosDataSource
+from numsos.DataSource import SosDataSource, concat_results
 
 # String mapping service for kokkos_app job_tags
 class SHA256_Mapper:
-    def __init__(self, cont):
+    DEF_CACHE_STRINGS = 1024 * 1024
+    DEF_SCAN_CHUNK = 4096
+    DEF_PROBE_MAX = 256
+
+    def __init__(self, cont, max_items=None, snapshot=None):
         """Implements a SHA256 ---> String mapping service
 
         kernel_names and job_tag are stored as SHA256 hash
         values because the associated strings can be very large
+
+        The strings that have been found are kept in an LRU cache,
+        so a hash that repeats is only looked up once.
+
+        Positional Parameters:
+        -- The container
+
+        Keyword Parameters:
+        max_items -- The maximum number of strings in the cache, the
+                     default is DEF_CACHE_STRINGS
+        snapshot  -- The path to a file that the cache is loaded from
+                     if it exists and that save() writes the cache to
         """
         self.src = SosDataSource()
         self.src.config(cont=cont)
-
-    def string(self, sha256):
+        if max_items is None:
+            max_items = self.DEF_CACHE_STRINGS
+        self.cache = LruCache(max_items=max_items)
+        self.snapshot = snapshot
+        if snapshot and os.path.exists(snapshot):
+            self.load(snapshot)
+
+    def _lookup(self, sha256):
         self.src.select([ '*' ],
             from_    = [ 'sha256_string' ],
             where    = [
@@ -28,6 +55,115 @@ class SHA256_Mapper:
             return res.array('string')[0]
         return ""
 
+    def string(self, sha256):
+        s = self.cache.get(sha256)
+        if s is None:
+            s = self._lookup(sha256)
+            if len(s):
+                # a missing string may be added later, it is not cached
+                self.cache.put(sha256, s)
+        return s
+
+    def strings(self, hashes):
+        """Return the string of each hash
+
+        The distinct hashes that are not in the cache are looked up
+        with a query for each hash if there are at most DEF_PROBE_MAX
+        of them. The hashes are uniformly distributed, so the range
+        from the smallest to the largest of a few hashes covers most
+        of the sha256 index. Otherwise they are read with one range
+        scan of the sha256 index, in DEF_SCAN_CHUNK row windows, from
+        the smallest to the largest of them. The scan stops when all
+        of them have been found.
+
+        Positional Parameters:
+        -- A list or array of hashes
+
+        Returns:
+        A list of the strings in the same order as the hashes
+        """
+        uniq, inverse = np.unique(np.asarray(hashes), return_inverse=True)
+        uniq = uniq.tolist()
+        found = {}
+        missing = {}
+        for sha256 in uniq:
+            s = self.cache.get(sha256)
+            if s is None:
+                missing[_hash_key(sha256)] = sha256
+            else:
+                found[sha256] = s
+        if len(missing) <= self.DEF_PROBE_MAX:
+            for sha256 in missing.values():
+                found[sha256] = self.string(sha256)
+        else:
+            # uniq is sorted, so are the missing hashes
+            wanted = [ sha256 for sha256 in uniq if _hash_key(sha256) in missing ]
+            self.src.select([ 'sha256', 'string' ],
+                from_    = [ 'sha256_string' ],
+                where    = [
+                            [ 'sha256', Sos.COND_GE, wanted[0] ],
+                            [ 'sha256', Sos.COND_LE, wanted[-1] ],
+                            ],
+                order_by = 'sha256',
+            )
+            remaining = len(missing)
+            for res in self.src.iter_results(chunk=self.DEF_SCAN_CHUNK):
+                size = res.get_series_size()
+                keys = res.array('sha256')[0:size]
+                values = res.array('string')[0:size]
+                for key, value in zip(keys, values):
+                    sha256 = missing.get(_hash_key(key))
+                    if sha256 is None or sha256 in found:
+                        continue
+                    found[sha256] = value
+                    # a missing string may be added later, it is not cached
+                    if len(value):
+                        self.cache.put(sha256, value)
+                    remaining -= 1
+                if remaining == 0:
+                    break
+        values = [ found.get(sha256, "") for sha256 in uniq ]
+        return [ values[i] for i in inverse.reshape(-1) ]
+
+    def save(self, path=None):
+        """Write the cache to the snapshot file
+
+        Keyword Parameters:
+        path -- The file to write, the default is the snapshot file
+        """
+        if path is None:
+            path = self.snapshot
+        if path is None:
+            raise ValueError("A snapshot path must be specified")
+        entries = [ [ _snapshot_value(key), _snapshot_value(value) ]
+                    for key, (value, size) in self.cache.items.items() ]
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp, path)
+
+    def load(self, path):
+        """Add the strings in a snapshot file to the cache"""
+        with open(path) as f:
+            entries = json.load(f)
+        for k, v in entries:
+            self.cache.put(_restore_value(k), _restore_value(v))
+
+def _hash_key(value):
+    if isinstance(value, bytes):
+        return value.decode('latin-1')
+    return str(value)
+
+def _snapshot_value(value):
+    if isinstance(value, bytes):
+        return [ 'b', value.decode('latin-1') ]
+    return [ 's', str(value) ]
+
+def _restore_value(value):
+    if value[0] == 'b':
+        return value[1].encode('latin-1')
+    return value[1]
+
 class Transform(object):
     def __init__(self, dataSrc, dataSink, limit=1024*1024, intervalMs=None):
         self.source = dataSrc
@@ -89,6 +225,49 @@ class Transform(object):
             return self._next(count=count, wait=wait, keep=keep, reset=False, interval_ms=self.interval_ms)
         return self._next(count=count, wait=wait, keep=keep, reset=False)
 
+    def poll(self, count=None):
+        """Push the data added since the last poll
+
+        The data source must be following a key, see
+        SosDataSource.follow(). Call self.source.commit() once the
+        data has been used to save the cursor.
+
+        Keyword Parameters:
+        count-- The maximum number of new samples to return
+
+        Returns:
+        The DataSet pushed to the stack or None if there is no new data
+        """
+        result = self.source.poll(limit=count)
+        if result is None:
+            return None
+        return self.stack.push(result)
+
+    def collect(self, count=None, wait=None):
+        """Read all of the series from the data source
+
+        The data source is read one window at a time and the windows
+        are copied once into a single DataSet that is pushed to the
+        stack. This replaces the begin() + next() + concat() loop
+        which copies the accumulated result for every window.
+
+        Keyword Parameters:
+        count-- The maximum number of samples in each window read
+                from the data source
+        wait -- A tuple specifying a function and argument that is
+                called if data is exhausted before count samples are
+                available
+
+        Returns:
+        The DataSet pushed to the stack or None if there is no data
+        """
+        if count is None:
+            count = self.window
+        result = concat_results(list(self.source.iter_results(chunk=count, wait=wait)))
+        if result is None:
+            return None
+        return self.stack.push(result)
+
     def diff(self, series_list, group_name=None, xfrm_suffix="_diff", keep=None, **kwargs):
         """Compute the difference of a series
 
@@ -101,7 +280,8 @@ class Transform(object):
 
         The 'group_name' parameter can be used to perform the
         difference on subsets of the series where other series in the
-        same row have the same value.
+        same row have the same value. It is a series name or a list of
+        series names, e.g. [ 'job_id', 'component_id' ].
 
         The 'xfrm_suffix' parameter specifies a string to append to
         the series names in the output.
@@ -116,7 +296,8 @@ class Transform(object):
         -- An array of series names
 
         Keyword Parameters:
-        group_name  -- The name of a series to group data together
+        group_name  -- The name of a series, or a list of series
+                       names, to group data together
         xfrm_suffix -- A string to append to the series names to
                        note that they are the difference of the
                        original series.
@@ -186,8 +367,7 @@ class Transform(object):
         inp = self.pop()
         grp_ser = inp.array(series_name)
         if value.ndim > 0:
-            key = bytearray(value)
-            grp_mask = [ key == bytearray(ent) for ent in grp_ser ]
+            grp_mask = np.all(grp_ser == value, axis=1)
         else:
             grp_mask = grp_ser == value
         grp_len = len(grp_ser[grp_mask])
@@ -199,31 +379,62 @@ class Transform(object):
         self.push(dataSet)
         return dataSet
 
-    def _for_each(self, series_list, xfrm_fn, values):
-        if len(series_list) == 0:
-            return xfrm_fn(values)
-        ser = series_list.pop(0)
-        data = self.dup()
-        self.unique(ser)
-        u = self.pop()
-        # values.append(0)
-        for v in u.array(0):
-            # All rows where top[ser] == v
-            self.push(data)
-            self.group(ser, v)
-            values.append(v)
-            self._for_each(series_list, xfrm_fn, values)
+    def partition(self, series_list, source=None):
+        """Partition a DataSet into groups of rows with equal values
+
+        The rows are ordered by the series in the series_list once
+        (see Group.Groups) and an iterator is returned that produces a
+        (values, DataSet) tuple for each group. The 'values' are the
+        values of the series_list series for the group and the series
+        in the DataSet are views of the ordered rows, i.e. the groups
+        are not copied. If the input is already in order, e.g. because
+        the query was ordered by an index on these series, the series
+        are views of the input.
+
+        Positional Parameters:
+        -- An array of series names
+
+        Keyword Parameters:
+        source -- The DataSet to partition instead of TOP. If not
+                  specified, TOP is popped from the stack.
+        """
+        if source is None:
+            source = self.stack.pop()
+        size = source.get_series_size()
+        groups = Groups([ source.array(ser) for ser in series_list ], size=size)
+        series = {}
+        for name in source.series:
+            series[name] = groups.take(source.array(name))
+        return self._partition(series_list, source.series, series, groups)
+
+    def _partition(self, series_list, series_names, series, groups):
+        for start, count in zip(groups.starts, groups.counts):
+            dataSet = DataSet()
+            for name in series_names:
+                dataSet.append_array(count, name, series[name][start:start+count])
+            dataSet.set_series_size(count)
+            yield [ series[ser][start] for ser in series_list ], dataSet
 
     def for_each(self, series_list, xfrm_fn):
-        ser = series_list.pop(0)
-        data = self.dup()
-        self.unique(ser)
-        uv = self.pop().array(0)
-        for v in uv:
-            # All rows where top[ser] == v
-            self.push(data)
-            self.group(ser, v)
-            self._for_each(series_list, xfrm_fn, [ v ])
+        """Call a function for each group of rows with equal values
+
+        The DataSet at TOP is partitioned by the series in the
+        series_list (see partition()). For each group, the group's
+        DataSet is pushed to the stack and xfrm_fn is called with the
+        list of the group's values, one for each series in the
+        series_list. The stack is restored when xfrm_fn returns. The
+        input remains on the stack.
+
+        Positional Parameters:
+        -- An array of series names
+        -- The function to call for each group
+        """
+        depth = len(self.stack)
+        for values, dataSet in self.partition(series_list, source=self.top()):
+            self.push(dataSet)
+            xfrm_fn(values)
+            while len(self.stack) > depth:
+                self.stack.drop()
 
     def _by_group(self, series_list, group_name, xfrm_suffix, xfrm_fn,
                   xfrm_len_fn=lambda src : 1, keep=None,
@@ -231,7 +442,11 @@ class Transform(object):
         """Group data by a series value
 
         The transform function is performed over each group of data
-        where the values in the group_name series are equal.
+        where the values in the group_name series are equal. If
+        group_name is a list of series names, the groups are formed
+        from the combination of the values in those series. The rows
+        are ordered by group once (see Group.Groups) and the numpy
+        reductions are computed over all of the groups together.
 
         The 'keep' list names the series that are to be copied
         (unmodified) to the result. If the series in the keep list are
@@ -242,7 +457,7 @@ class Transform(object):
 
         Positional Parameters:
         -- An array of series names
-        -- The series by which data will be grouped
+        -- The series, or list of series, by which data will be grouped
 
         Keyword Parameters:
         xfrm_fn -- The transform to perform on each series in the
@@ -253,60 +468,48 @@ class Transform(object):
         """
         if keep is None:
             keep = []
-        if group_name not in keep:
-            keep.insert(0, group_name)
+        else:
+            keep = list(keep)
+        if type(group_name) in (list, tuple):
+            group_names = list(group_name)
+        else:
+            group_names = [ group_name ]
+        for name in reversed(group_names):
+            if name not in keep:
+                keep.insert(0, name)
         dst_names = keep + [ ser + xfrm_suffix for ser in series_list ]
         src_names = keep + [ ser for ser in series_list ]
         inp = self.stack.pop()
 
-        # compute the unique values in the group_by series
-        grp = inp.array(group_name)
-        uniq = np.unique(grp)
+        # order the rows by the group_by series once
+        groups = Groups([ inp.array(name) for name in group_names ],
+                        size=inp.get_series_size())
 
         # compute the result size
-        res_size = 0
-        grp_start = {}
-        grp_len = {}
         if 'axis' in kwargs:
             axis = kwargs['axis']
         else:
             axis = 0            # over rows
             kwargs['axis'] = axis
-        for value in uniq:
-            grp_src = grp[grp == value]
-            if axis == 0:
-                grp_len[value] = xfrm_len_fn(grp_src)
-            else:
-                grp_len[value] = len(grp_src)
-            grp_start[value] = res_size
-            res_size += grp_len[value]
+        if axis == 0:
+            grp_len = np.array([ xfrm_len_fn(range(count)) for count in groups.counts ],
+                               dtype=np.int64)
+        else:
+            grp_len = groups.counts
+        res_size = int(np.sum(grp_len))
 
         # Allocate the result arrays.
         res = self._clone(inp, src_names, dst_names, res_size, xfrm_len_fn, axis)
 
         # copy the group and keep data to the result. src_names and
         # dst_names are the same for keep columns
-        start_row = 0
-        for value in uniq:
-            for col in range(0, len(keep)):
-                name = keep[col]
-                src = inp.array(name)
-                grp_src = src[grp == value]
-                grp_dst = res.array(name)
-                start_row = grp_start[value]
-                res_len = grp_len[value]
-                grp_dst[start_row:start_row+res_len] = grp_src[0:res_len]
+        for name in keep:
+            res.array(name)[0:res_size] = groups.first(inp.array(name), grp_len)
 
         ser_col = len(keep)
         for col in range(ser_col, ser_col + len(series_list)):
             src = inp.array(src_names[col])
-            for value in uniq:
-                grp_src = src[grp == value]
-                grp_dst = res.array(dst_names[col])
-                start_row = grp_start[value]
-                res_len = grp_len[value]
-                grp_dst[start_row:start_row+res_len] = xfrm_fn(grp_src, **kwargs)
-            col += 1
+            res.array(dst_names[col])[0:res_size] = groups.apply(xfrm_fn, src, **kwargs)
         return res
 
     def histogram(self, series_list, xfrm_suffix="_hist",
@@ -396,7 +599,7 @@ class Transform(object):
         """Compute min for series across rows
         """
         if group_name:
-            res = self._by_group(series_list, group_name, xfrm_suffix, np.min, keep=keep)
+            res = self._by_group(series_list, group_name, xfrm_suffix, np.min, keep=keep, **kwargs)
         else:
             res = self._by_row(series_list, xfrm_suffix, np.min, **kwargs)
         return self.stack.push(res)
@@ -447,6 +650,81 @@ class Transform(object):
             res.array(col)[0] = inp.array(col)[row]
         return self.stack.push(res)
 
+    def topk(self, series, k, largest=True, group_name=None, keep=None):
+        """Return the k rows with the largest or smallest values
+
+        The rows are selected with numpy.argpartition, which does not
+        sort the series, and only the k selected rows are then
+        ordered, largest (or smallest) first. Equal values are in row
+        order, so the top k rows are the first k rows of the top 2k.
+        NaN values are never selected before a number.
+
+        If group_name is specified, the result contains the top k
+        rows of each group, the groups are in the order of the group
+        values.
+
+        Positional Parameters:
+        -- The name of the series
+        -- The number of rows
+
+        Keyword Parameters:
+        largest    -- If True, select the largest values, otherwise
+                      the smallest
+        group_name -- The name of a series, or a list of series names,
+                      by which data is grouped
+        keep       -- The series copied to the result, the default is
+                      all of the series. The group series and the
+                      series are always included.
+        """
+        inp = self.stack.pop()
+        size = inp.get_series_size()
+        if group_name:
+            if type(group_name) not in (list, tuple):
+                group_name = [ group_name ]
+        else:
+            group_name = []
+        if keep is None:
+            keep = inp.series
+        names = []
+        for name in list(group_name) + list(keep) + [ series ]:
+            if name not in names:
+                names.append(name)
+
+        # order by key ascending, NaN last
+        src = inp.array(series)[0:size].astype(np.float64)
+        key = -src if largest else src.copy()
+        key[np.isnan(key)] = np.inf
+        k = max(0, int(k))
+        if group_name:
+            groups = Groups([ inp.array(name) for name in group_name ], size)
+            rows = np.arange(size)
+            if groups.order is not None:
+                rows = rows[groups.order]
+            # order each group by key, the groups stay in order
+            group_no = np.repeat(np.arange(len(groups)), groups.counts)
+            rows = rows[np.lexsort((key[rows], group_no))]
+            rank = np.arange(size) - np.repeat(groups.starts, groups.counts)
+            rows = rows[rank < k]
+        elif k == 0:
+            rows = np.zeros([ 0 ], dtype=np.int64)
+        elif k < size:
+            # argpartition picks an arbitrary subset of the values
+            # equal to the k-th, take the first ones instead
+            kth = np.max(key[np.argpartition(key, k - 1)[0:k]])
+            less = np.nonzero(key < kth)[0]
+            ties = np.nonzero(key == kth)[0][0:k - len(less)]
+            rows = np.concatenate((less, ties))
+            rows = rows[np.argsort(key[rows], kind='stable')]
+        else:
+            rows = np.argsort(key, kind='stable')
+
+        count = len(rows)
+        res = DataSet()
+        for name in names:
+            res.append_array(count, name, inp.array(name)[0:size][rows])
+        res.set_series_size(count)
+        return self.stack.push(res)
+
     def std(self, series_list, group_name=None, xfrm_suffix="_std", keep=None, **kwargs):
         """Compute the standard deviation of a series
 
@@ -456,7 +734,8 @@ class Transform(object):
         -- An array of series names
 
         Keyword Parameters:
-        group_by -- The name of a series by which data is grouped.
+        group_name -- The name of a series, or a list of series names,
+                      by which data is grouped.
         """
         if group_name:
             res = self._by_group(series_list, group_name, xfrm_suffix, np.std, keep=keep, **kwargs)
@@ -482,6 +761,136 @@ class Transform(object):
                                **kwargs)
         return self.stack.push(res)
 
+    def aggregate(self, series_list,
+                  aggs=[ 'min', 'argmin', 'max', 'argmax', 'mean', 'std' ],
+                  group_name=None, ddof=0):
+        """Compute several aggregates of several series at once
+
+        Pop the top of the stack and push a DataSet with a series
+        named series-name + '_' + aggregate-name for each series and
+        aggregate, e.g. 'cpi_min', 'cpi_argmin'. The argmin and argmax
+        aggregates are the row number in the input of the first
+        minimum or maximum value; use them to look up other series at
+        that row, for example the rank with the minimum value.
+
+        This replaces a dup() and a reduction for each series and
+        aggregate, e.g. min() followed by minrow(), with a single
+        traversal of each series. Only the requested aggregates are
+        computed. An array series is aggregated along the rows, each
+        element of the result is the aggregate of a column. As with
+        the row transforms, NaN and infinite values are replaced with
+        numbers, see numpy.nan_to_num.
+
+        Positional Parameters:
+        -- An array of series names
+
+        Keyword Parameters:
+        aggs       -- The aggregates to compute, any of 'min',
+                      'argmin', 'max', 'argmax', 'sum', 'mean', 'std'
+        group_name -- The name of a series, or a list of series names,
+                      by which data is grouped. The result has a row
+                      for each group and includes the group series.
+        ddof       -- The delta degrees of freedom of 'std'
+        """
+        for agg in aggs:
+            if agg not in ( 'min', 'argmin', 'max', 'argmax', 'sum', 'mean', 'std' ):
+                raise ValueError("{0} is not a supported aggregate".format(agg))
+        inp = self.stack.pop()
+        size = inp.get_series_size()
+        if group_name:
+            if type(group_name) not in (list, tuple):
+                group_name = [ group_name ]
+            groups = Groups([ inp.array(name) for name in group_name ], size)
+            starts = groups.starts
+            counts = groups.counts
+        else:
+            group_name = []
+            groups = None
+            if size:
+                starts = np.zeros([ 1 ], dtype=np.int64)
+                counts = np.array([ size ])
+            else:
+                starts = np.zeros([ 0 ], dtype=np.int64)
+                counts = np.zeros([ 0 ], dtype=np.int64)
+        count = len(starts)
+
+        res = DataSet()
+        for name in group_name:
+            res.append_array(count, name, groups.take(inp.array(name))[starts])
+        rows = np.arange(size)
+        if groups is not None:
+            rows = groups.take(rows)
+        for ser in series_list:
+            src = np.nan_to_num(inp.array(ser)[0:size])
+            if groups is not None:
+                src = groups.take(src)
+            # The counts and row numbers broadcast over the columns of
+            # an array series
+            shape = (-1,) + (1,) * (src.ndim - 1)
+            values = {}
+            if count:
+                if set(aggs) & set([ 'sum', 'mean', 'std' ]):
+                    values['sum'] = np.add.reduceat(src, starts, axis=0)
+                    values['mean'] = values['sum'] / counts.reshape(shape)
+                if 'std' in aggs:
+                    dev = src - np.repeat(values['mean'], counts, axis=0)
+                    values['std'] = np.sqrt(np.add.reduceat(dev * dev, starts, axis=0) /
+                                            (counts - ddof).reshape(shape))
+                for agg, ufunc in (( 'min', np.minimum ), ( 'max', np.maximum )):
+                    if agg not in aggs and 'arg' + agg not in aggs:
+                        continue
+                    values[agg] = ufunc.reduceat(src, starts, axis=0)
+                    if 'arg' + agg in aggs:
+                        # The first row in each group equal to the extremum
+                        first = np.where(src == np.repeat(values[agg], counts, axis=0),
+                                         np.arange(size).reshape(shape), size)
+                        values['arg' + agg] = rows[np.minimum.reduceat(first, starts, axis=0)]
+            for agg in aggs:
+                if agg in values:
+                    nda = values[agg]
+                elif agg.startswith('arg'):
+                    nda = np.zeros((0,) + src.shape[1:], dtype=np.int64)
+                else:
+                    nda = np.zeros((0,) + src.shape[1:])
+                res.append_array(count, ser + '_' + agg, nda)
+        res.set_series_size(count)
+        return self.stack.push(res)
+
+    def derive(self, spec, chunk=None, numexpr=False):
+        """Compute derived series from arithmetic expressions
+
+        Pop the top of the stack and push a DataSet containing its
+        series followed by the derived series. A derived series that
+        has the same name as an input series replaces it.
+
+        Positional Parameters:
+        -- A dictionary of series name to expression, or a
+           DerivedMetrics, see numsos.Derived.DerivedMetrics
+
+        Keyword Parameters:
+        chunk   -- The number of rows evaluated at a time
+        numexpr -- Evaluate the expressions with numexpr if it is
+                   installed
+
+        Example:
+
+            xfrm.derive({ 'cpi' : 'tot_cyc / tot_ins',
+                          'uopi' : '(ld_ins + sr_ins) / tot_ins' })
+        """
+        if not isinstance(spec, DerivedMetrics):
+            spec = DerivedMetrics(spec, chunk=chunk, numexpr=numexpr)
+        inp = self.stack.pop()
+        size = inp.get_series_size()
+        outputs = spec.evaluate(inp, size)
+        res = DataSet()
+        for name in inp.series:
+            if name not in outputs:
+                res.append_array(size, name, inp.array(name)[0:size])
+        for name in spec.names:
+            res.append_array(size, name, outputs[name])
+        res.set_series_size(size)
+        return self.stack.push(res)
+
     def unique(self, series_name, result=None):
         """Return the unique values of a series
 
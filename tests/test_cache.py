@@ -0,0 +1,125 @@
+import os
+import time
+import numpy as np
+import pytest
+
+pytest.importorskip('sosdb')
+from sosdb.DataSet import DataSet
+from sosdb import Sos
+from numsos.Cache import ResultCache, LruCache, container_path, query_generation
+
+def dataset(rows):
+    ds = DataSet()
+    ds.append_array(rows, 'x', np.arange(rows, dtype=np.float64))
+    ds.append_array(rows, 'ts', np.arange(rows).astype('datetime64[us]'))
+    ds.set_series_size(rows)
+    return ds
+
+def test_result_round_trip(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    spec = ( '/cont', [ 'x', 'ts' ], None, 1000 )
+    key = cache.key(spec)
+    assert cache.get(key, 1) is None
+    assert cache.put(key, spec, dataset(10), 1)
+    res = cache.get(key, 1)
+    assert res.get_series_size() == 10
+    assert np.array_equal(res.array('x'), np.arange(10.0))
+    assert res.array('ts').dtype == np.dtype('datetime64[us]')
+    # A result of an older generation of the container is ignored
+    assert cache.get(key, 2) is None
+
+def test_object_series_not_stored(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    ds = DataSet()
+    ds.append_array(2, 'o', np.array([ 'a', None ], dtype=object))
+    ds.set_series_size(2)
+    assert not cache.put(cache.key(1), 1, ds)
+
+def test_evict_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path), max_entries=3)
+    for spec in range(3):
+        cache.put(cache.key(spec), spec, dataset(10))
+        time.sleep(0.01)
+    # Using a result makes it the most recently used
+    assert cache.get(cache.key(0)) is not None
+    time.sleep(0.01)
+    cache.put(cache.key(3), 3, dataset(10))
+    assert sorted(os.listdir(str(tmp_path))) == \
+        sorted(cache.key(spec) for spec in (0, 2, 3))
+
+def test_evict_byte_budget(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=4096)
+    cache.put(cache.key(0), 0, dataset(10))
+    # The result just stored is kept even if it exceeds the budget
+    cache.put(cache.key(1), 1, dataset(1000))
+    assert os.listdir(str(tmp_path)) == [ cache.key(1) ]
+
+def test_lru_max_items():
+    cache = LruCache(max_items=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.get('b', 'missing') == 'missing'
+
+def test_lru_max_bytes():
+    cache = LruCache(max_bytes=100)
+    cache.put('a', 1, 40)
+    cache.put('b', 2, 40)
+    cache.put('a', 3, 50)
+    assert cache.bytes == 90 and len(cache) == 2
+    cache.put('c', 4, 30)
+    assert 'b' not in cache and cache.bytes == 80
+    # An item larger than the budget replaces everything else
+    cache.put('d', 5, 500)
+    assert len(cache) == 1 and cache.get('d') == 5
+    cache.clear()
+    assert len(cache) == 0 and cache.bytes == 0
+
+def test_container_path(tmp_path):
+    class Container(object):
+        def __init__(self, path):
+            self.p = path
+        def path(self):
+            return self.p
+    path = str(tmp_path)
+    assert container_path(Container(path + '/')) == container_path(path)
+    assert container_path(Container(path.encode('utf-8'))) == os.path.realpath(path)
+
+def test_put_race_not_stored(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path))
+    def rename(src, dst):
+        raise OSError(39, 'Directory not empty')
+    # Another process stored the same key first
+    monkeypatch.setattr(os, 'rename', rename)
+    assert not cache.put(cache.key(0), 0, dataset(10))
+    assert os.listdir(str(tmp_path)) == []
+
+def test_get_removed_result(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    key = cache.key(0)
+    cache.put(key, 0, dataset(10))
+    os.remove(os.path.join(str(tmp_path), key, '1.npy'))
+    assert cache.get(key) is None
+
+def test_query_generation(tmp_path):
+    cont = tmp_path / 'cont'
+    (cont / 'part').mkdir(parents=True)
+    (cont / 'part' / 'data').write_text('1')
+    now = time.time()
+    closed = [ ('timestamp', Sos.COND_GE, (int(now) - 7200, 0)),
+               ('timestamp', Sos.COND_LE, (int(now) - 3600, 0)) ]
+    opened = [ ('timestamp', Sos.COND_GE, (int(now) - 7200, 0)) ]
+    gen = query_generation(str(cont), closed)
+    open_gen = query_generation(str(cont), opened)
+    # New samples only change the result of a query of recent data
+    time.sleep(0.01)
+    (cont / 'part' / 'data').write_text('2')
+    assert query_generation(str(cont), closed) == gen
+    assert query_generation(str(cont), opened) != open_gen
+    assert query_generation(str(cont), closed, lag=7200) != gen
+    # A new partition changes every result
+    (cont / 'new').mkdir()
+    assert query_generation(str(cont), closed) != gen
@@ -0,0 +1,169 @@
+import json
+import numpy as np
+import pytest
+
+pytest.importorskip('sosdb')
+pytest.importorskip('numsos.Inputer')
+from sosdb import Sos
+from sosdb.DataSet import DataSet
+from numsos.DataSource import SosDataSource, concat_results
+
+def dataset(**series):
+    size = len(list(series.values())[0])
+    ds = DataSet()
+    for name, nda in series.items():
+        ds.append_array(size, name, np.asarray(nda))
+    ds.set_series_size(size)
+    return ds
+
+def test_concat_results():
+    a = dataset(x=np.arange(3.0), v=np.arange(6.0).reshape(3, 2))
+    b = dataset(x=np.arange(3.0, 5.0), v=np.arange(6.0, 10.0).reshape(2, 2))
+    res = concat_results([ a, b ])
+    assert res.get_series_size() == 5
+    assert np.array_equal(res.array('x'), np.arange(5.0))
+    assert np.array_equal(res.array('v'), np.arange(10.0).reshape(5, 2))
+    assert concat_results([ a ]) is a
+    assert concat_results([]) is None
+
+class Table(object):
+    """Rows ordered by timestamp, several components per timestamp
+
+    Replaces the select() and get_results() of a SosDataSource so
+    that poll() can be tested without a container.
+    """
+    def __init__(self, seconds, components):
+        self.seconds = np.repeat(np.asarray(seconds), components)
+        self.comp = np.tile(np.arange(components), len(seconds))
+
+    def attach(self, src):
+        src.select = self.select
+        src.get_results = self.get_results
+
+    def select(self, columns, where=None, **kwargs):
+        self.where = where
+
+    def get_results(self, limit=None, **kwargs):
+        rows = np.ones(len(self.seconds), dtype=bool)
+        for name, cond, value in self.where:
+            if cond == Sos.COND_GT:
+                rows &= self.seconds * 1000000 > value[0] * 1000000 + value[1]
+        rows = np.nonzero(rows)[0][0:limit]
+        if len(rows) == 0:
+            return None
+        usecs = (self.seconds[rows] * 1000000).astype(np.int64)
+        return dataset(timestamp=usecs.astype('datetime64[us]'),
+                       component_id=self.comp[rows])
+
+@pytest.mark.parametrize('limit', [ 1, 2, 3, 4, 5, 7 ])
+def test_poll_limit_keeps_equal_keys(tmp_path, limit):
+    table = Table(np.arange(10), 3)
+    src = SosDataSource()
+    table.attach(src)
+    cursor = str(tmp_path / 'cursor')
+    src.follow([ 'timestamp', 'component_id' ], 'timestamp', cursor=cursor)
+    seen = []
+    res = src.poll(limit=limit)
+    while res is not None:
+        size = res.get_series_size()
+        seen += list(zip(res.array('timestamp')[0:size].astype(np.int64),
+                         res.array('component_id')[0:size]))
+        res = src.poll(limit=limit)
+    # Every row is returned once, in order
+    assert seen == list(zip((table.seconds * 1000000).astype(np.int64), table.comp))
+    # The cursor is only written by commit()
+    assert not (tmp_path / 'cursor').exists()
+    src.commit()
+    with open(cursor) as f:
+        assert json.load(f) == { "key" : "timestamp", "value" : [ 9, 0 ] }
+
+def test_poll_resumes_from_cursor(tmp_path):
+    table = Table(np.arange(10), 2)
+    cursor = str(tmp_path / 'cursor')
+    src = SosDataSource()
+    table.attach(src)
+    src.follow([ 'timestamp', 'component_id' ], 'timestamp', cursor=cursor)
+    # The two rows of timestamp 3 do not both fit and are left
+    assert src.poll(limit=7).get_series_size() == 6
+    src.commit()
+    # A new follower continues after the committed rows
+    src = SosDataSource()
+    table.attach(src)
+    src.follow([ 'timestamp', 'component_id' ], 'timestamp', cursor=cursor)
+    res = src.poll()
+    assert res.get_series_size() == 14
+    assert res.array('timestamp')[0] == np.datetime64(3, 's')
+
+class Obj(object):
+    def __init__(self, schema, fail):
+        self.schema = schema
+        self.fail = fail
+        self.values = {}
+
+    def __setitem__(self, attr_id, value):
+        if value == self.fail:
+            raise ValueError("The value cannot be assigned")
+        self.values[attr_id] = value
+
+    def index_add(self):
+        self.schema.indexed.append(self.values[0])
+
+    def delete(self):
+        self.schema.deleted.append(self)
+
+class Schema(object):
+    def __init__(self, max_objs, fail=None):
+        self.max_objs = max_objs
+        self.fail = fail
+        self.allocated = 0
+        self.indexed = []
+        self.deleted = []
+
+    def alloc(self):
+        if self.allocated == self.max_objs:
+            return None
+        self.allocated += 1
+        return Obj(self, self.fail)
+
+def put(schema, count, batch):
+    src = SosDataSource()
+    mapping = { 'schema' : schema, 'obj_cols' : np.array([ 0, 1 ]),
+                'cvt_fns' : [ None, None ] }
+    rows = np.arange(count)
+    src._put_columns(mapping, [ rows, rows * 2.0 ], count, batch)
+
+def test_put_columns_indexes_on_alloc_failure():
+    schema = Schema(max_objs=6)
+    with pytest.raises(MemoryError):
+        put(schema, 10, 4)
+    # Every allocated object is indexed, none is left unreachable
+    assert schema.indexed == [ 0, 1, 2, 3, 4, 5 ]
+
+def test_put_columns_deletes_partial_object():
+    schema = Schema(max_objs=100, fail=6.0)
+    with pytest.raises(ValueError):
+        put(schema, 10, 4)
+    # Row 3 failed on its second attribute, it is deleted
+    assert schema.indexed == [ 0, 1, 2 ]
+    assert len(schema.deleted) == 1
+    assert schema.allocated == 4
+
+def test_put_columns_batches():
+    schema = Schema(max_objs=100)
+    put(schema, 10, 4)
+    assert schema.indexed == list(range(10))
+
+def test_csv_bulk_columns():
+    import io
+    from numsos.DataSource import CsvDataSource
+    src = CsvDataSource()
+    src.config(file=io.StringIO('#ts,job_id\n1,2\n'), schema='csv')
+    src.select([ 'ts', 'job_id' ])
+    assert src._bulk_columns()
+    src.select([ 'ts', Sos.ColSpec('job_id', cvt_fn=float) ])
+    # A float converter may not be readable from the ColSpec, then
+    # the column is converted by the ColSpec
+    assert src._bulk_columns() == hasattr(src.columns[1], 'cvt_fn')
+    # An int column is never parsed as double
+    src.select([ 'ts', Sos.ColSpec('job_id', cvt_fn=int) ])
+    assert not src._bulk_columns()
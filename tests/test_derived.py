@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from numsos.Derived import DerivedMetrics
+
+SPEC = { 'mem_acc' : 'ld_ins + sr_ins',
+         'cpi'     : 'tot_cyc / tot_ins',
+         'uopi'    : 'mem_acc / tot_ins',
+         'l1_miss' : '(l1_icm + l1_dcm) / tot_ins',
+         'l1_rate' : '(l1_icm + l1_dcm) / tot_cyc * 2 ** 3',
+         'fn'      : 'sqrt(abs(ld_ins - sr_ins)) + maximum(ld_ins, -1.5)' }
+
+@pytest.fixture
+def inputs():
+    rng = np.random.default_rng(4)
+    size = 1000
+    data = { name : rng.random(size) * 100 for name in
+             [ 'ld_ins', 'sr_ins', 'tot_cyc', 'tot_ins', 'l1_icm', 'l1_dcm' ] }
+    data['tot_ins'][[ 5, 17 ]] = 0
+    return data
+
+def plain(d):
+    """The derived metrics computed one expression at a time"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        res = {}
+        res['mem_acc'] = d['ld_ins'] + d['sr_ins']
+        res['cpi'] = d['tot_cyc'] / d['tot_ins']
+        res['uopi'] = res['mem_acc'] / d['tot_ins']
+        res['l1_miss'] = (d['l1_icm'] + d['l1_dcm']) / d['tot_ins']
+        res['l1_rate'] = (d['l1_icm'] + d['l1_dcm']) / d['tot_cyc'] * 2 ** 3
+        res['fn'] = np.sqrt(np.abs(d['ld_ins'] - d['sr_ins'])) + np.maximum(d['ld_ins'], -1.5)
+    return res
+
+@pytest.mark.parametrize('chunk', [ None, 7, 1000, 4096 ])
+def test_evaluate_matches_plain(inputs, chunk):
+    derived = DerivedMetrics(SPEC, chunk=chunk)
+    assert derived.names == list(SPEC.keys())
+    assert sorted(derived.inputs) == sorted(inputs.keys())
+    res = derived.evaluate(inputs)
+    ref = plain(inputs)
+    for name in SPEC:
+        assert np.allclose(res[name], ref[name], equal_nan=True), name
+
+def test_evaluate_size(inputs):
+    res = DerivedMetrics(SPEC).evaluate(inputs, size=10)
+    ref = plain({ name : nda[0:10] for name, nda in inputs.items() })
+    assert len(res['cpi']) == 10
+    assert np.allclose(res['uopi'], ref['uopi'], equal_nan=True)
+
+def test_replace_input(inputs):
+    spec = { 'before'  : 'tot_ins * 1',
+             'tot_ins' : 'tot_ins / 2',
+             'after'   : 'tot_ins * 1' }
+    res = DerivedMetrics(spec).evaluate(inputs)
+    assert np.array_equal(res['before'], inputs['tot_ins'])
+    assert np.array_equal(res['after'], inputs['tot_ins'] / 2)
+
+def test_invalid_expression():
+    with pytest.raises(ValueError):
+        DerivedMetrics({ 'x' : 'a +' })
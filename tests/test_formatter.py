@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('sosdb')
+pytest.importorskip('pandas')
+from graf_analysis.grafanaFormatter import json_column
+
+def test_json_column_strings():
+    nda = np.array([ b'node1', u'nöde'.encode('utf-8'), b'\xff' ])
+    assert json_column(nda) == [ 'node1', u'nöde', u'�' ]
+    assert json_column(np.array([ 'a', 'b' ])) == [ 'a', 'b' ]
+    assert json_column(np.array([ b'\xff', None ], dtype=object)) == [ u'�', None ]
+
+def test_json_column_missing_values():
+    nda = np.array([ 1.5, np.nan ])
+    assert json_column(nda) == [ 1.5, None ]
+    nda = np.array([ 1000, 'NaT' ], dtype='datetime64[ms]')
+    assert json_column(nda) == [ 1000.0, None ]
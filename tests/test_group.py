@@ -0,0 +1,156 @@
+import numpy as np
+import pytest
+from numsos.Group import Groups, TimeBuckets, group_diff, bin_sum
+
+def per_group(fn, keys, nda, **kwargs):
+    """The result of fn applied to the rows of each group by masking"""
+    if type(keys) not in (list, tuple):
+        keys = [ keys ]
+    uniq = np.unique(np.stack(keys, axis=1), axis=0)
+    res = []
+    for values in uniq:
+        mask = np.all(np.stack(keys, axis=1) == values, axis=1)
+        r = np.asarray(fn(nda[mask], **kwargs))
+        if r.ndim < nda.ndim:
+            r = r.reshape((1,) + r.shape)
+        res.append(r)
+    return np.concatenate(res)
+
+@pytest.fixture
+def rows():
+    rng = np.random.default_rng(1)
+    job_id = rng.integers(1, 6, 200)
+    comp_id = rng.integers(1, 4, 200)
+    values = rng.random(200) * 100
+    return job_id, comp_id, values
+
+@pytest.mark.parametrize('fn', [ np.sum, np.mean, np.min, np.max, np.std, np.diff ])
+def test_apply_matches_per_group(rows, fn):
+    job_id, comp_id, values = rows
+    groups = Groups(job_id)
+    assert np.allclose(groups.apply(fn, values), per_group(fn, job_id, values))
+
+def test_apply_ordered_input(rows):
+    job_id, comp_id, values = rows
+    order = np.argsort(job_id, kind='stable')
+    groups = Groups(job_id[order])
+    assert groups.order is None
+    assert np.allclose(groups.apply(np.sum, values[order]),
+                       per_group(np.sum, job_id, values))
+
+def test_apply_multiple_keys(rows):
+    job_id, comp_id, values = rows
+    groups = Groups([ job_id, comp_id ])
+    assert np.allclose(groups.apply(np.max, values),
+                       per_group(np.max, [ job_id, comp_id ], values))
+    assert np.array_equal(groups.take(job_id)[groups.starts],
+                          np.unique(np.stack([ job_id, comp_id ], axis=1), axis=0)[:,0])
+
+def test_apply_ddof_and_generic(rows):
+    job_id, comp_id, values = rows
+    groups = Groups(job_id)
+    assert np.allclose(groups.apply(np.std, values, ddof=1),
+                       per_group(np.std, job_id, values, ddof=1))
+    assert np.allclose(groups.apply(np.median, values),
+                       per_group(np.median, job_id, values))
+
+def test_apply_2d(rows):
+    job_id, comp_id, values = rows
+    nda = np.stack([ values, values * 2 ], axis=1)
+    groups = Groups(job_id)
+    assert np.allclose(groups.apply(np.sum, nda), per_group(np.sum, job_id, nda, axis=0))
+
+def test_size_and_empty():
+    groups = Groups(np.array([ 3, 1, 3, 9, 9 ]), size=3)
+    assert len(groups) == 2
+    assert list(groups.counts) == [ 1, 2 ]
+    empty = Groups(np.zeros([ 0 ]))
+    assert len(empty) == 0
+    assert len(empty.apply(np.sum, np.zeros([ 0 ]))) == 0
+
+def per_bucket(start, width, size, seconds, values):
+    """The min, mean, max and count of each non-empty bucket by masking"""
+    res = []
+    for b in range(size):
+        lo = start + b * width
+        mask = (seconds >= lo) & (seconds < lo + width)
+        if np.any(mask):
+            res.append((lo, values[mask].min(), values[mask].mean(),
+                        values[mask].max(), np.count_nonzero(mask)))
+    return np.array(res)
+
+def test_time_buckets_match_per_bucket():
+    rng = np.random.default_rng(2)
+    seconds = np.sort(rng.uniform(1000, 2000, 500))
+    values = rng.random(500)
+    buckets = TimeBuckets(1000, 2000, count=37)
+    # The data is added a chunk at a time
+    for chunk in np.array_split(np.arange(500), 7):
+        buckets.add(seconds[chunk], { 'x' : values[chunk] })
+    ref = per_bucket(1000, buckets.width, buckets.size, seconds, values)
+    assert np.allclose(buckets.times(), ref[:,0])
+    assert np.allclose(buckets.min('x'), ref[:,1])
+    assert np.allclose(buckets.mean('x'), ref[:,2])
+    assert np.allclose(buckets.max('x'), ref[:,3])
+    assert np.array_equal(buckets.count(), ref[:,4])
+
+def test_time_buckets_datetime64_and_range():
+    seconds = np.array([ 5.0, 10.0, 10.5, 19.9, 20.0, 25.0 ])
+    timestamps = (seconds * 1e6).astype('datetime64[us]')
+    buckets = TimeBuckets(10, 20, width=5)
+    buckets.add(timestamps, { 'x' : seconds })
+    # Rows outside [start, end) are ignored
+    assert list(buckets.times()) == [ 10.0, 15.0 ]
+    assert list(buckets.count()) == [ 2, 1 ]
+    assert list(buckets.sum('x')) == [ 20.5, 19.9 ]
+    with pytest.raises(ValueError):
+        TimeBuckets(0, 10)
+
+def test_time_buckets_skip_nan():
+    seconds = np.array([ 0.0, 1.0, 2.0, 5.0, 6.0, 10.0 ])
+    values = np.array([ 1.0, np.nan, 3.0, np.nan, np.nan, np.inf ])
+    buckets = TimeBuckets(0, 15, width=5)
+    buckets.add(seconds, { 'x' : values })
+    assert list(buckets.count()) == [ 3, 2, 1 ]
+    assert list(buckets.min('x')[0:1]) == [ 1.0 ]
+    assert list(buckets.max('x')[0:1]) == [ 3.0 ]
+    assert list(buckets.mean('x')[0:1]) == [ 2.0 ]
+    assert list(buckets.sum('x')) == [ 4.0, 0.0, 0.0 ]
+    # A bucket without a finite value has no statistics
+    assert np.all(np.isnan(buckets.min('x')[1:]))
+    assert np.all(np.isnan(buckets.max('x')[1:]))
+    assert np.all(np.isnan(buckets.mean('x')[1:]))
+
+def test_group_diff_matches_per_group():
+    rng = np.random.default_rng(5)
+    comp_id = rng.integers(1, 6, 300)
+    job_id = rng.integers(1, 3, 300)
+    values = rng.random((300, 2)) * 10
+    values[7, 0] = np.nan
+    res = group_diff([ comp_id, job_id ], values)
+    ref = np.zeros(values.shape)
+    for comp in np.unique(comp_id):
+        for job in np.unique(job_id):
+            rows = np.nonzero((comp_id == comp) & (job_id == job))[0]
+            if len(rows) > 1:
+                ref[rows[1:]] = values[rows[1:]] - values[rows[:-1]]
+    ref[np.isnan(ref)] = 0
+    assert np.allclose(res, ref)
+    ref = np.zeros([ len(comp_id) ])
+    for comp in np.unique(comp_id):
+        rows = np.nonzero(comp_id == comp)[0]
+        ref[rows[1:]] = np.diff(values[rows,1])
+    assert np.allclose(group_diff(comp_id, values[:,1]), ref)
+
+@pytest.mark.parametrize('range_', [ None, (100.0, 200.0), (150.0, 150.0) ])
+def test_bin_sum_matches_histogram(range_):
+    rng = np.random.default_rng(6)
+    times = np.round(rng.uniform(100, 200, 500))
+    weights = rng.random((500, 3))
+    sums, edges = bin_sum(times, weights, 20, range=range_)
+    for col in range(3):
+        hist, ref_edges = np.histogram(times, bins=20, range=range_, weights=weights[:,col])
+        assert np.allclose(sums[:,col], hist)
+        assert np.allclose(edges, ref_edges)
+    hist, ref_edges = np.histogram(times, bins=20, range=range_, weights=weights[:,0])
+    assert np.allclose(bin_sum(times, weights[:,0], 20, range=range_)[0], hist)
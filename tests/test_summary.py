@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('sosdb')
+pytest.importorskip('numsos.Inputer')
+from sosdb import Sos
+from sosdb.DataSet import DataSet
+from numsos.Summary import JobSummarizer
+
+def dataset(**series):
+    size = len(list(series.values())[0])
+    ds = DataSet()
+    for name, nda in series.items():
+        ds.append_array(size, name, np.asarray(nda))
+    ds.set_series_size(size)
+    return ds
+
+class Obj(dict):
+    def __init__(self, schema, values):
+        dict.__init__(self, values)
+        self.schema = schema
+        self.indexed = True
+
+    def index_del(self):
+        self.indexed = False
+
+    def index_add(self):
+        self.indexed = True
+
+class Filter(object):
+    """The objects of the schema with a job_id"""
+    def __init__(self, attr):
+        self.schema = attr
+
+    def add_condition(self, attr, cond, value):
+        assert cond == Sos.COND_EQ
+        self.objs = [ obj for obj in self.schema.objs if obj['job_id'] == value ]
+
+    def begin(self):
+        self.pos = 0
+        return self.next()
+
+    def next(self):
+        if self.pos == len(self.objs):
+            return None
+        self.pos += 1
+        return self.objs[self.pos - 1]
+
+class Schema(object):
+    def __init__(self):
+        self.objs = []
+
+    def __getitem__(self, name):
+        return self
+
+class Source(object):
+    """Stores put_results() as objects of the schema"""
+    def __init__(self, schema, samples):
+        self.schema = schema
+        self.samples = samples
+
+    def get_schema(self, name):
+        return self.schema
+
+    def poll(self, limit=None):
+        return self.samples.pop(0) if self.samples else None
+
+    def put_results(self, key, results):
+        size = results.get_series_size()
+        for row in range(size):
+            self.schema.objs.append(Obj(self.schema, { name : results.array(name)[row]
+                                                       for name in results.series }))
+
+    def commit(self):
+        pass
+
+def test_update_folds_rollups(monkeypatch):
+    monkeypatch.setattr(Sos, 'Filter', Filter, raising=False)
+    schema = Schema()
+    samples = [ dataset(timestamp=np.array([ 1.0, 1.0, 2.0 ]),
+                        job_id=np.array([ 5, 6, 5 ]),
+                        component_id=np.array([ 1, 1, 1 ]),
+                        x=np.array([ 1.0, 10.0, 3.0 ])),
+                dataset(timestamp=np.array([ 3.0, 3.0, 4.0 ]),
+                        job_id=np.array([ 5, 5, 6 ]),
+                        component_id=np.array([ 1, 2, 1 ]),
+                        x=np.array([ -2.0, 7.0, 4.0 ])) ]
+    summ = JobSummarizer.__new__(JobSummarizer)
+    summ.derived = None
+    summ.metrics = [ 'x' ]
+    summ.summary = 'summary'
+    summ.src = Source(schema, samples)
+    summ.run()
+    # One object per job and component however many updates there are
+    objs = { (obj['job_id'], obj['component_id']) : obj for obj in schema.objs }
+    assert len(schema.objs) == len(objs) == 3
+    obj = objs[(5, 1)]
+    assert (obj['first'], obj['last'], obj['count']) == (1.0, 3.0, 3)
+    assert (obj['x_min'], obj['x_max'], obj['x_sum'], obj['x_sumsq']) == (-2.0, 3.0, 2.0, 14.0)
+    assert objs[(6, 1)]['x_sum'] == 14.0 and objs[(6, 1)]['count'] == 2
+    assert objs[(5, 2)]['count'] == 1
+    assert all(obj.indexed for obj in schema.objs)
@@ -0,0 +1,159 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('sosdb')
+pytest.importorskip('numsos.Inputer')
+from sosdb import Sos
+from sosdb.DataSet import DataSet
+from numsos.Cache import LruCache
+from numsos.Transform import Transform, SHA256_Mapper
+
+def dataset(**series):
+    size = len(list(series.values())[0])
+    ds = DataSet()
+    for name, nda in series.items():
+        ds.append_array(size, name, np.asarray(nda))
+    ds.set_series_size(size)
+    return ds
+
+@pytest.fixture
+def rows():
+    rng = np.random.default_rng(3)
+    job_id = rng.integers(1, 5, 100).astype(np.float64)
+    # Repeated values exercise the first-row rule of argmin/argmax
+    cpi = rng.integers(0, 10, 100).astype(np.float64)
+    ipc = rng.random(100)
+    return job_id, cpi, ipc
+
+def test_aggregate_matches_per_group(rows):
+    job_id, cpi, ipc = rows
+    xfrm = Transform(None, None)
+    xfrm.push(dataset(job_id=job_id, cpi=cpi, ipc=ipc))
+    res = xfrm.aggregate([ 'cpi', 'ipc' ], group_name='job_id', ddof=1,
+                         aggs=[ 'min', 'argmin', 'max', 'argmax', 'sum', 'mean', 'std' ])
+    jobs = np.unique(job_id)
+    assert np.array_equal(res.array('job_id'), jobs)
+    for name, nda in (( 'cpi', cpi ), ( 'ipc', ipc )):
+        for i, job in enumerate(jobs):
+            rows = np.nonzero(job_id == job)[0]
+            values = nda[rows]
+            assert res.array(name + '_min')[i] == values.min()
+            assert res.array(name + '_max')[i] == values.max()
+            assert res.array(name + '_argmin')[i] == rows[np.argmin(values)]
+            assert res.array(name + '_argmax')[i] == rows[np.argmax(values)]
+            assert np.isclose(res.array(name + '_sum')[i], values.sum())
+            assert np.isclose(res.array(name + '_mean')[i], values.mean())
+            assert np.isclose(res.array(name + '_std')[i], values.std(ddof=1))
+
+def test_aggregate_without_groups(rows):
+    job_id, cpi, ipc = rows
+    xfrm = Transform(None, None)
+    xfrm.push(dataset(cpi=cpi))
+    res = xfrm.aggregate([ 'cpi' ], aggs=[ 'argmax', 'mean' ])
+    assert res.get_series_size() == 1
+    assert res.array('cpi_argmax')[0] == np.argmax(cpi)
+    assert np.isclose(res.array('cpi_mean')[0], cpi.mean())
+    with pytest.raises(ValueError):
+        xfrm.aggregate([ 'cpi' ], aggs=[ 'median' ])
+
+def test_aggregate_array_series(rows):
+    job_id, cpi, ipc = rows
+    nda = np.stack([ cpi, ipc ], axis=1)
+    xfrm = Transform(None, None)
+    xfrm.push(dataset(job_id=job_id, v=nda))
+    res = xfrm.aggregate([ 'v' ], group_name='job_id',
+                         aggs=[ 'argmin', 'max', 'mean', 'std' ])
+    assert res.series == [ 'job_id', 'v_argmin', 'v_max', 'v_mean', 'v_std' ]
+    for i, job in enumerate(np.unique(job_id)):
+        rows = np.nonzero(job_id == job)[0]
+        values = nda[rows]
+        assert np.array_equal(res.array('v_argmin')[i], rows[np.argmin(values, axis=0)])
+        assert np.array_equal(res.array('v_max')[i], values.max(axis=0))
+        assert np.allclose(res.array('v_mean')[i], values.mean(axis=0))
+        assert np.allclose(res.array('v_std')[i], values.std(axis=0))
+
+def sorted_rows(values, k, largest):
+    """The first k rows of a stable sort, NaN last"""
+    key = -values if largest else values.copy()
+    key[np.isnan(key)] = np.inf
+    return np.argsort(key, kind='stable')[0:k]
+
+@pytest.mark.parametrize('largest', [ True, False ])
+@pytest.mark.parametrize('k', [ 0, 1, 5, 40, 200 ])
+def test_topk_matches_sort(rows, k, largest):
+    job_id, cpi, ipc = rows
+    cpi = cpi.copy()
+    cpi[[ 3, 50 ]] = np.nan
+    xfrm = Transform(None, None)
+    xfrm.push(dataset(job_id=job_id, cpi=cpi))
+    res = xfrm.topk('cpi', k, largest=largest)
+    expect = sorted_rows(cpi, k, largest)
+    assert res.get_series_size() == len(expect)
+    assert np.array_equal(res.array('job_id'), job_id[expect])
+    assert np.array_equal(res.array('cpi'), cpi[expect], equal_nan=True)
+
+@pytest.mark.parametrize('largest', [ True, False ])
+def test_topk_by_group(rows, largest):
+    job_id, cpi, ipc = rows
+    xfrm = Transform(None, None)
+    xfrm.push(dataset(job_id=job_id, cpi=cpi, ipc=ipc))
+    res = xfrm.topk('cpi', 3, largest=largest, group_name='job_id', keep=[ 'ipc' ])
+    assert res.series == [ 'job_id', 'ipc', 'cpi' ]
+    expect = []
+    for job in np.unique(job_id):
+        rows = np.nonzero(job_id == job)[0]
+        expect += list(rows[sorted_rows(cpi[rows], 3, largest)])
+    assert np.array_equal(res.array('job_id'), job_id[expect])
+    assert np.array_equal(res.array('ipc'), ipc[expect])
+
+class Strings(object):
+    """A sha256_string index that records the queries"""
+    def __init__(self, count):
+        self.keys = np.array([ b'%04d' % i for i in range(count) ])
+        self.values = np.array([ b'name-%d' % i for i in range(count) ])
+        self.queries = []
+
+    def select(self, columns, where=None, **kwargs):
+        self.where = where
+        self.queries.append([ cond[1] for cond in where ])
+
+    def rows(self):
+        rows = np.ones(len(self.keys), dtype=bool)
+        for name, cond, value in self.where:
+            if cond in (Sos.COND_EQ, Sos.COND_GE):
+                rows &= self.keys >= value
+            if cond in (Sos.COND_EQ, Sos.COND_LE):
+                rows &= self.keys <= value
+        return np.nonzero(rows)[0]
+
+    def get_results(self, limit=None, **kwargs):
+        rows = self.rows()[0:limit]
+        if len(rows) == 0:
+            return None
+        return dataset(sha256=self.keys[rows], string=self.values[rows])
+
+    def iter_results(self, chunk=None, **kwargs):
+        rows = self.rows()
+        for first in range(0, len(rows), chunk):
+            part = rows[first:first + chunk]
+            yield dataset(sha256=self.keys[part], string=self.values[part])
+
+@pytest.mark.parametrize('probe_max', [ 0, 256 ])
+def test_sha256_strings(probe_max):
+    mapper = SHA256_Mapper.__new__(SHA256_Mapper)
+    mapper.cache = LruCache()
+    mapper.src = Strings(100)
+    mapper.DEF_PROBE_MAX = probe_max
+    mapper.DEF_SCAN_CHUNK = 7
+    hashes = [ b'0042', b'0003', b'0042', b'9999', b'0090' ]
+    assert mapper.strings(hashes) == \
+        [ b'name-42', b'name-3', b'name-42', '', b'name-90' ]
+    if probe_max:
+        # A few hashes are looked up one at a time
+        assert mapper.src.queries == [ [ Sos.COND_EQ ] ] * 4
+    else:
+        assert mapper.src.queries == [ [ Sos.COND_GE, Sos.COND_LE ] ]
+    # The strings that were found are cached
+    mapper.src.queries = []
+    assert mapper.strings([ b'0090', b'0003' ]) == [ b'name-90', b'name-3' ]
+    assert mapper.src.queries == []